@@ -0,0 +1,199 @@
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+import iNaturalist_api as api
+from iNaturalist_observaciones import paginas_columnas
+from iNaturalist_taxones import RANGOS_ESPECIE, RANGOS_INFRAESPECIFICOS, padre
+
+# =========================
+# Almacén local de observaciones de un usuario
+# =========================
+# Copia en SQLite las observaciones verificables de un usuario con los campos
+# que usan los informes (fecha, taxón, ancestros, foto). La primera vez se
+# descarga todo por cursor id_above; después cada sincronización pide sólo lo
+# creado o editado desde la última (updated_since), que suelen ser una o dos
+# páginas. Las bajas (observaciones borradas o que dejan de ser verificables)
+# no aparecen en updated_since: si el total del servidor no coincide con el
+# local se repasa la lista de ids (sólo el campo id) y se borra lo que sobra.
+
+ALMACEN_DB = os.environ.get(
+    "INAT_ALMACEN_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "observaciones.sqlite")
+)
+if api.REPLAY_URL or api.RECORD_DIR:
+    # Grabando o reproduciendo se empieza cada vez con un almacén vacío: así se graba
+    # (y se reproduce) la descarga completa y no una consulta updated_since de otro día
+    ALMACEN_DB = os.path.join(tempfile.mkdtemp(prefix="inat_almacen_"), "observaciones.sqlite")
+
+# Margen para no perder ediciones que ocurran mientras se sincroniza
+MARGEN_SYNC = timedelta(minutes=5)
+
+COLUMNAS = {
+    "id": ("id",),
+    "observed_on": ("observed_on",),
+    "updated_at": ("updated_at",),
+    "taxon_id": ("taxon", "id"),
+    "taxon_name": ("taxon", "name"),
+    "taxon_rank": ("taxon", "rank"),
+    "ancestor_ids": ("taxon", "ancestor_ids"),
+    "common_name": ("taxon", "preferred_common_name"),
+    "photo_url": ("taxon", "default_photo", "medium_url"),
+}
+
+
+def conectar(ruta=ALMACEN_DB):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    conn = sqlite3.connect(ruta)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS observaciones (
+            id INTEGER PRIMARY KEY,
+            user_login TEXT NOT NULL,
+            observed_on TEXT,
+            updated_at TEXT,
+            taxon_id INTEGER,
+            taxon_name TEXT,
+            taxon_rank TEXT,
+            ancestor_ids TEXT,
+            common_name TEXT,
+            photo_url TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_obs_usuario_fecha ON observaciones (user_login, observed_on);
+        CREATE TABLE IF NOT EXISTS sincronizaciones (
+            user_login TEXT PRIMARY KEY,
+            ultima TEXT NOT NULL
+        );
+    """)
+    return conn
+
+
+def _guardar_pagina(conn, username, pagina):
+    filas = zip(
+        pagina["id"].tolist(),
+        [username] * len(pagina["id"]),
+        pagina["observed_on"].tolist(),
+        pagina["updated_at"].tolist(),
+        pagina["taxon_id"].tolist(),
+        pagina["taxon_name"].tolist(),
+        pagina["taxon_rank"].tolist(),
+        [json.dumps(a) if a else None for a in pagina["ancestor_ids"].tolist()],
+        pagina["common_name"].tolist(),
+        pagina["photo_url"].tolist(),
+    )
+    conn.executemany("INSERT OR REPLACE INTO observaciones VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", filas)
+    conn.commit()
+
+
+def _total_servidor(username):
+    data = api.get_json("observations", {"user_login": username, "verifiable": "true", "per_page": 0})
+    return None if data is None else data.get("total_results")
+
+
+def _reconciliar_bajas(conn, username):
+    remotos = set()
+    try:
+        for pagina in paginas_columnas({"user_login": username, "verifiable": "true"}, {"id": ("id",)}, geo=False):
+            remotos.update(pagina["id"].tolist())
+    except api.DescargaIncompleta as e:
+        # Con la lista de ids a medias se borrarían observaciones válidas
+        print(f"⚠️ No se pudo repasar la lista de ids ({e}); no se borra nada.")
+        return 0
+    locales = {fila[0] for fila in conn.execute("SELECT id FROM observaciones WHERE user_login = ?", (username,))}
+    bajas = locales - remotos
+    if bajas:
+        conn.executemany("DELETE FROM observaciones WHERE id = ?", [(i,) for i in bajas])
+        conn.commit()
+    return len(bajas)
+
+
+def sincronizar(username, conn=None):
+    conn = conn or conectar()
+    inicio = datetime.now(timezone.utc) - MARGEN_SYNC
+    fila = conn.execute("SELECT ultima FROM sincronizaciones WHERE user_login = ?", (username,)).fetchone()
+
+    params = {"user_login": username, "verifiable": "true"}
+    if fila:
+        params["updated_since"] = fila[0]
+        print(f"Sincronizando observaciones de {username} cambiadas desde {fila[0]}…")
+    else:
+        print(f"Primera sincronización de {username}: descargando todo el historial…")
+
+    # Checkpoint del cursor: si se corta la primera descarga se reanuda donde iba
+    checkpoint = f"{ALMACEN_DB}.{username}.cursor.json"
+    cambios = 0
+    try:
+        for pagina in paginas_columnas(params, COLUMNAS, geo=False, checkpoint=checkpoint):
+            _guardar_pagina(conn, username, pagina)
+            cambios += len(pagina["id"])
+    except api.DescargaIncompleta as e:
+        # Lo guardado se queda, pero la fecha de la última sincronización no avanza:
+        # la próxima vez se repite la misma consulta y reanuda desde el checkpoint
+        print(f"⚠️ Sincronización incompleta ({e}); {cambios} observaciones guardadas, se completará en la próxima ejecución.")
+        return conn
+
+    total_local = conn.execute("SELECT COUNT(*) FROM observaciones WHERE user_login = ?", (username,)).fetchone()[0]
+    total_remoto = _total_servidor(username)
+    bajas = 0
+    if total_remoto is not None and total_remoto != total_local:
+        bajas = _reconciliar_bajas(conn, username)
+
+    conn.execute("INSERT OR REPLACE INTO sincronizaciones VALUES (?, ?)", (username, inicio.isoformat(timespec="seconds")))
+    conn.commit()
+    print(f"Almacén al día: {cambios} observaciones nuevas o editadas, {bajas} eliminadas.")
+    return conn
+
+
+# =========================
+# Primera vez que se ve cada taxón
+# =========================
+def dataframe(username, conn=None):
+    # Historial del usuario con fecha y taxón, ordenado por fecha
+    conn = conn or conectar()
+    df = pd.read_sql_query(
+        "SELECT id, observed_on, taxon_id, taxon_name, taxon_rank, ancestor_ids, common_name, photo_url "
+        "FROM observaciones WHERE user_login = ? AND observed_on IS NOT NULL AND taxon_id IS NOT NULL "
+        "ORDER BY observed_on, id",
+        conn, params=(username,)
+    )
+    # Todas las listas de ancestros en un único json.loads en lugar de uno por fila
+    ancestros = json.loads("[" + ",".join(a if isinstance(a, str) else "[]" for a in df["ancestor_ids"]) + "]")
+    df["ancestor_ids"] = pd.Series(ancestros, index=df.index, dtype=object)
+    return df
+
+
+def primeras_vistas(df):
+    # Una fila por taxón nuevo para el usuario, con la observación en que se vio
+    # por primera vez:
+    #   - subespecies, variedades... cuentan como su especie (su padre);
+    #   - un taxón superior (género, familia...) sólo cuenta si en esa fecha aún
+    #     no se había visto ninguna especie que descienda de él.
+    # Todo se resuelve con operaciones de pandas, sin recorrer las observaciones.
+    df = df.sort_values(["observed_on", "id"], kind="stable")
+    infra = df["taxon_rank"].isin(RANGOS_INFRAESPECIFICOS)
+    es_especie = df["taxon_rank"].isin(RANGOS_ESPECIE) | infra
+
+    clave = df["taxon_id"].copy()
+    if infra.any():
+        clave[infra] = [padre(a, t) for a, t in zip(df.loc[infra, "ancestor_ids"], df.loc[infra, "taxon_id"])]
+    df = df.assign(clave=clave, es_especie=es_especie)
+
+    primeras = df.drop_duplicates("clave", keep="first")
+    especies = primeras[primeras["es_especie"]]
+    superiores = primeras[~primeras["es_especie"]]
+
+    # Índice ancestro -> primera fecha en que se vio alguna especie por debajo de él.
+    # especies ya está ordenado por fecha, así que basta con la primera aparición de
+    # cada ancestro (un groupby().min() sobre fechas en texto va fila a fila en Python)
+    linajes = especies[["observed_on", "ancestor_ids"]].explode("ancestor_ids").dropna()
+    linajes = linajes.assign(ancestor_ids=linajes["ancestor_ids"].astype("int64"))
+    cubierto_desde = linajes.drop_duplicates("ancestor_ids", keep="first").set_index("ancestor_ids")["observed_on"]
+
+    fecha_cubierto = superiores["clave"].map(cubierto_desde)
+    superiores = superiores[fecha_cubierto.isna() | (fecha_cubierto > superiores["observed_on"])]
+
+    return pd.concat([especies, superiores]).sort_values(["observed_on", "id"], kind="stable")
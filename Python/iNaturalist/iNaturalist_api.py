@@ -0,0 +1,258 @@
+import asyncio
+import json
+import math
+import os
+import time
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import iNaturalist_cache as cache
+from iNaturalist_limitador import limitador
+
+# =========================
+# Cliente compartido de la API de iNaturalist
+# =========================
+# Todos los scripts de esta carpeta importan este módulo en lugar de llamar a
+# requests.get directamente. Una única Session reutiliza las conexiones
+# (keep-alive HTTP/1.1), así que cada página de species_counts, cada /taxa/{id}
+# y cada foto ya no abre una conexión TCP+TLS nueva. Las respuestas de
+# species_counts, taxa y places pasan además por la caché de iNaturalist_cache,
+# y todas las peticiones a la API esperan turno en el limitador compartido
+# (iNaturalist_limitador) en lugar de dormir un tiempo fijo.
+#
+# Variables de entorno (ver iNaturalist_replay):
+#   INAT_API_URL     URL base de la API (por defecto la pública)
+#   INAT_REPLAY_URL  servidor de reproducción local: API y fotos salen de ahí
+#   INAT_RECORD_DIR  graba todas las respuestas en esa carpeta
+
+REPLAY_URL = os.environ.get("INAT_REPLAY_URL", "").rstrip("/")
+API_URL = os.environ.get("INAT_API_URL") or (f"{REPLAY_URL}/v1" if REPLAY_URL else "https://api.inaturalist.org/v1")
+RECORD_DIR = os.environ.get("INAT_RECORD_DIR")
+TIMEOUT = 30
+MAX_REINTENTOS = 5
+MAX_REINTENTOS_429 = 20
+
+session = requests.Session()
+session.headers.update({"User-Agent": "JaigoL-data-analysis/1.0"})
+_adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32)
+session.mount("https://", _adapter)
+session.mount("http://", _adapter)
+
+if RECORD_DIR:
+    # Al grabar no se lee la caché, para que la grabación tenga todas las respuestas
+    from iNaturalist_replay import activar_grabacion
+
+    cache.REFRESH = True
+    activar_grabacion(session, RECORD_DIR, API_URL)
+if REPLAY_URL:
+    # Reproduciendo no se toca la caché: las medidas son del servidor local
+    cache.DESACTIVADA = True
+
+
+def api_url(endpoint):
+    # Acepta tanto rutas relativas ("observations/species_counts") como URLs completas
+    if endpoint.startswith("http://") or endpoint.startswith("https://"):
+        return endpoint
+    return f"{API_URL}/{endpoint.lstrip('/')}"
+
+
+def ruta(endpoint):
+    # Forma relativa del endpoint, usada como clave de caché
+    if endpoint.startswith(API_URL):
+        return endpoint[len(API_URL):].strip("/")
+    return endpoint.strip("/")
+
+
+# =========================
+# Peticiones con reintentos
+# =========================
+def get_json(endpoint, params=None, max_reintentos=MAX_REINTENTOS):
+    url = api_url(endpoint)
+    data = cache.leer(ruta(endpoint), params)
+    if data is not None:
+        return data
+
+    intento = 0
+    intentos_429 = 0
+    while intento < max_reintentos:
+        limitador.adquirir()
+        try:
+            r = session.get(url, params=params, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            limitador.registrar()
+            intento += 1
+            print(f"⚠️ Error en request {url}: {e}. Reintento {intento}/{max_reintentos}...")
+            time.sleep(min(2 ** intento, 30))
+            continue
+        limitador.registrar(r.status_code, r.headers)
+
+        if r.status_code == 429:
+            # El limitador ya ha reducido la tasa y bloquea hasta Retry-After; no cuenta
+            # como fallo, pero tiene su propio tope para no reintentar indefinidamente
+            intentos_429 += 1
+            if intentos_429 > MAX_REINTENTOS_429:
+                print(f"❌ Demasiadas respuestas 429 seguidas para {url}")
+                return None
+            print("Demasiadas solicitudes, el limitador reduce la tasa antes de reintentar...")
+            continue
+        if r.status_code >= 500:
+            intento += 1
+            print(f"⚠️ Error del servidor ({r.status_code}) en {url}. Reintento {intento}/{max_reintentos}...")
+            time.sleep(min(2 ** intento, 30))
+            continue
+        if r.status_code != 200:
+            print(f"Request failed for {url} with status code: {r.status_code}")
+            return None
+        data = r.json()
+        cache.guardar(ruta(endpoint), params, data)
+        return data
+
+    print(f"❌ Se agotaron los reintentos para {url}")
+    return None
+
+
+def get_bytes(url, timeout=10):
+    # Descarga binaria (fotos) por la misma Session; devuelve None si falla
+    if REPLAY_URL and not url.startswith(REPLAY_URL):
+        url = f"{REPLAY_URL}/_externo?" + urlencode({"url": url})
+    try:
+        r = session.get(url, timeout=timeout)
+    except requests.RequestException:
+        return None
+    if r.status_code != 200:
+        return None
+    return r.content
+
+
+# =========================
+# Paginación
+# =========================
+class DescargaIncompleta(RuntimeError):
+    # Una página no se pudo descargar: lo recibido hasta ahí no es el total
+    pass
+
+
+def paginar_concurrente(endpoint, params, per_page=100, concurrencia=8):
+    # Paginación por page=N: lee la página 1, calcula cuántas páginas hay con
+    # total_results y pide el resto a la vez (el limitador sigue marcando el ritmo).
+    # Los resultados salen en orden de página. Si falla cualquier
+    # página se lanza DescargaIncompleta: una lista con huecos daría por no vistas
+    # especies que sí lo están.
+    params = dict(params)
+    params["per_page"] = per_page
+    params["page"] = 1
+    data = get_json(endpoint, params)
+    if data is None:
+        raise DescargaIncompleta(f"no se pudo descargar la página 1 de {ruta(endpoint)}")
+    results = data.get("results", [])
+    yield from results
+
+    total = data.get("total_results") or 0
+    paginas = math.ceil(total / per_page)
+    if len(results) < per_page or paginas <= 1:
+        return
+
+    restantes = range(2, paginas + 1)
+    peticiones = [(endpoint, {**params, "page": page}) for page in restantes]
+    respuestas = get_json_concurrente(peticiones, concurrencia)
+    fallidas = [page for page, data in zip(restantes, respuestas) if data is None]
+    if fallidas:
+        raise DescargaIncompleta(f"no se pudieron descargar las páginas {fallidas} de {ruta(endpoint)}")
+    for data in respuestas:
+        yield from data.get("results", [])
+
+
+def get_json_concurrente(peticiones, concurrencia=8):
+    # Lanza a la vez una lista de (endpoint, params) y devuelve las respuestas en el
+    # mismo orden (None donde get_json no lo consiguió). El limitador sigue mandando.
+    async def descargar():
+        semaforo = asyncio.Semaphore(concurrencia)
+
+        async def una(endpoint, params):
+            async with semaforo:
+                return await asyncio.to_thread(get_json, endpoint, params)
+
+        return await asyncio.gather(*(una(endpoint, params) for endpoint, params in peticiones))
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(descargar())
+    # Ya hay un bucle de eventos en marcha (p. ej. Jupyter): se descargan en serie
+    return [get_json(endpoint, params) for endpoint, params in peticiones]
+
+
+def paginas_por_id(endpoint, params, per_page=200, checkpoint=None):
+    # Paginación por cursor para /observations: order_by=id asc + id_above=<último id>.
+    # Entrega cada página entera (lista de resultados). Cada página cuesta lo mismo
+    # sin importar la profundidad y no hay tope de 10.000 resultados como con
+    # page=N. Si se pasa un fichero checkpoint, se guarda en él el último id
+    # procesado para poder reanudar tras un corte; al terminar la descarga completa
+    # el checkpoint se borra. Si una página falla se lanza DescargaIncompleta (y el
+    # checkpoint se conserva) en lugar de terminar como si no hubiera más datos.
+    params = dict(params)
+    params.update({"per_page": per_page, "order_by": "id", "order": "asc"})
+    params.pop("page", None)
+    id_above = leer_cursor(checkpoint, params) if checkpoint else None
+
+    while True:
+        if id_above is not None:
+            params["id_above"] = id_above
+        data = get_json(endpoint, params)
+        if data is None:
+            raise DescargaIncompleta(f"no se pudo descargar {ruta(endpoint)} a partir de id_above={id_above}")
+        results = data.get("results", [])
+        if not results:
+            break
+        yield results
+        id_above = results[-1]["id"]
+        if checkpoint:
+            guardar_cursor(checkpoint, params, id_above)
+        if len(results) < per_page:
+            break
+
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+
+def _firma_cursor(params):
+    return {k: str(v) for k, v in sorted(params.items()) if k not in ("id_above", "page")}
+
+
+def leer_cursor(checkpoint, params):
+    # Devuelve el id donde reanudar, o None si no hay checkpoint de esta misma consulta
+    if not os.path.exists(checkpoint):
+        return None
+    try:
+        with open(checkpoint, encoding="utf-8") as f:
+            estado = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if estado.get("params") != _firma_cursor(params):
+        print(f"⚠️ El checkpoint {checkpoint} es de otra consulta, se empieza desde el principio.")
+        return None
+    print(f"Reanudando desde id_above={estado['id_above']}")
+    return estado["id_above"]
+
+
+def guardar_cursor(checkpoint, params, id_above):
+    tmp = checkpoint + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"params": _firma_cursor(params), "id_above": id_above}, f)
+    os.replace(tmp, checkpoint)
+
+
+# =========================
+# Utilidades comunes
+# =========================
+def get_place_name(place_id, default="lugar desconocido"):
+    data = get_json(f"places/{place_id}")
+    if data is None:
+        print("No se pudo obtener el nombre del lugar")
+        return default
+    results = data.get("results", [])
+    if results:
+        return results[0].get("display_name", default)
+    return default
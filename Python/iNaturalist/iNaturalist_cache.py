@@ -0,0 +1,144 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+# =========================
+# Caché persistente de respuestas de la API
+# =========================
+# Guarda en SQLite las respuestas JSON (comprimidas con zlib) indexadas por
+# endpoint + parámetros normalizados. Cada endpoint tiene su propia caducidad
+# (TTL) y el fichero se mantiene por debajo de MAX_BYTES expulsando primero las
+# entradas usadas hace más tiempo (LRU).
+#
+# Ejecutar cualquier script con --refresh (o INAT_REFRESH=1) ignora lo guardado
+# y vuelve a descargarlo todo, actualizando la caché. INAT_NO_CACHE=1 la apaga.
+
+CACHE_DB = os.environ.get(
+    "INAT_CACHE_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "api_cache.sqlite")
+)
+MAX_BYTES = 512 * 1024 * 1024
+
+HORA = 3600
+DIA = 24 * HORA
+
+# TTL en segundos por prefijo de endpoint; lo que no aparece aquí no se cachea
+TTL = {
+    "observations/species_counts": 12 * HORA,
+    "taxa": 30 * DIA,
+    "places": 90 * DIA,
+}
+
+# Consultas que cambian en cuanto el usuario sube algo (su lista de vida, una
+# ventana de fechas, lo editado desde...): caducan a los pocos minutos, lo justo
+# para no repetirlas dentro de una misma sesión.
+PARAMETROS_VOLATILES = ("user_login", "d1", "d2", "updated_since")
+TTL_VOLATIL = 10 * 60
+
+REFRESH = "--refresh" in sys.argv or os.environ.get("INAT_REFRESH") == "1"
+DESACTIVADA = os.environ.get("INAT_NO_CACHE") == "1"
+
+_lock = threading.Lock()
+_conn = None
+
+
+def _conexion():
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(CACHE_DB), exist_ok=True)
+        _conn = sqlite3.connect(CACHE_DB, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS respuestas (
+                clave TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                creado REAL NOT NULL,
+                accedido REAL NOT NULL,
+                tamano INTEGER NOT NULL,
+                datos BLOB NOT NULL
+            )
+        """)
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_accedido ON respuestas (accedido)")
+        _conn.commit()
+    return _conn
+
+
+def ttl_para(endpoint, params=None):
+    # El prefijo más largo gana: "observations/species_counts" antes que "observations"
+    mejor = None
+    for prefijo in TTL:
+        if endpoint == prefijo or endpoint.startswith(prefijo + "/"):
+            if mejor is None or len(prefijo) > len(mejor):
+                mejor = prefijo
+    if not mejor:
+        return 0
+    if any((params or {}).get(p) is not None for p in PARAMETROS_VOLATILES):
+        return min(TTL[mejor], TTL_VOLATIL)
+    return TTL[mejor]
+
+
+def clave(endpoint, params=None):
+    # Normaliza los parámetros: orden fijo, valores como texto y sin "None"
+    normalizados = {
+        str(k): str(v).lower() if isinstance(v, bool) else str(v)
+        for k, v in (params or {}).items()
+        if v is not None
+    }
+    return endpoint.strip("/") + "?" + json.dumps(normalizados, sort_keys=True, separators=(",", ":"))
+
+
+def leer(endpoint, params=None):
+    ttl = ttl_para(endpoint, params)
+    if not ttl or REFRESH or DESACTIVADA:
+        return None
+    k = clave(endpoint, params)
+    with _lock:
+        conn = _conexion()
+        fila = conn.execute("SELECT creado, datos FROM respuestas WHERE clave = ?", (k,)).fetchone()
+        if fila is None:
+            return None
+        creado, datos = fila
+        if time.time() - creado > ttl:
+            conn.execute("DELETE FROM respuestas WHERE clave = ?", (k,))
+            conn.commit()
+            return None
+        conn.execute("UPDATE respuestas SET accedido = ? WHERE clave = ?", (time.time(), k))
+        conn.commit()
+    return json.loads(zlib.decompress(datos))
+
+
+def guardar(endpoint, params, data):
+    if not ttl_para(endpoint, params) or DESACTIVADA:
+        return
+    k = clave(endpoint, params)
+    datos = zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"), 6)
+    ahora = time.time()
+    with _lock:
+        conn = _conexion()
+        conn.execute(
+            "INSERT OR REPLACE INTO respuestas (clave, endpoint, creado, accedido, tamano, datos) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (k, endpoint.strip("/"), ahora, ahora, len(datos), datos)
+        )
+        _expulsar(conn)
+        conn.commit()
+
+
+def _expulsar(conn):
+    total = conn.execute("SELECT COALESCE(SUM(tamano), 0) FROM respuestas").fetchone()[0]
+    if total <= MAX_BYTES:
+        return
+    # Borra las menos usadas recientemente hasta quedar en el 90 % del límite
+    objetivo = total - int(MAX_BYTES * 0.9)
+    liberado = 0
+    borrar = []
+    for k, tamano in conn.execute("SELECT clave, tamano FROM respuestas ORDER BY accedido ASC"):
+        borrar.append((k,))
+        liberado += tamano
+        if liberado >= objetivo:
+            break
+    conn.executemany("DELETE FROM respuestas WHERE clave = ?", borrar)
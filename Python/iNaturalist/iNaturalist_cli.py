@@ -0,0 +1,146 @@
+import argparse
+import os
+import runpy
+import sys
+
+from iNaturalist_parametros import PARAMETROS
+
+# =========================
+# Línea de comandos común
+# =========================
+# Un único punto de entrada para los informes de esta carpeta:
+#
+#   python iNaturalist_cli.py endemic --taxon 48460 --lugar 30000 --lista
+#   python iNaturalist_cli.py unobserved --taxon 3 --lugar 146746 --usuario jaigol
+#   python iNaturalist_cli.py guide --taxon 3 --lugar 10543 --salida guia.pdf
+#
+# Cada subcomando ejecuta el script correspondiente con los parámetros dados (lo
+# que no se indique toma el valor por defecto del script). Aquí sólo se importa
+# argparse: requests, pandas, PIL, fpdf, geopandas, matplotlib o reportlab los
+# importa cada script en el momento en que los necesita, así que un informe en
+# modo --lista no carga nada de PDF ni de mapas.
+
+CARPETA = os.path.dirname(os.path.abspath(__file__))
+
+
+def meses(texto):
+    return [int(m) for m in texto.split(",") if m.strip()]
+
+
+def crear_parser():
+    parser = argparse.ArgumentParser(prog="iNaturalist_cli", description="Informes de iNaturalist")
+    parser.add_argument("--refresh", action="store_true", help="ignorar la caché local y volver a pedirlo todo")
+    parser.add_argument("--fotos", dest="perfil_fotos", choices=["borrador", "pantalla", "impresion"],
+                        help="resolución de las fotos en los PDF (por defecto pantalla)")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser("endemic", help="especies endémicas de un lugar")
+    p.add_argument("--taxon", dest="taxon_ids", type=int, nargs="+")
+    p.add_argument("--lugar", dest="place_id", type=int, nargs="+", help="con --madre admite varios lugares hija")
+    p.add_argument("--madre", dest="place_id_madre", type=int,
+                   help="método extensivo: especies con casi todas las observaciones de la madre en el lugar")
+    p.add_argument("--error", dest="error_observaciones", type=int, help="margen del método extensivo")
+    p.add_argument("--min-obs", dest="min_observations", type=int)
+    p.add_argument("--salida", dest="salida")
+    p.add_argument("--lista", action="store_true", default=None, help="imprimir la lista en lugar del PDF")
+
+    p = sub.add_parser("unobserved", help="especies de un lugar o un área que el usuario no ha observado")
+    p.add_argument("--taxon", dest="taxon_ids", type=int, nargs="+")
+    p.add_argument("--lugar", dest="place_id", type=int)
+    p.add_argument("--coordenadas", nargs=2, type=float, metavar=("LAT", "LNG"))
+    p.add_argument("--radio", dest="radius", type=float, help="km alrededor de --coordenadas")
+    p.add_argument("--usuario", dest="username", nargs="+", help="uno o varios: especies que no ha visto ninguno")
+    p.add_argument("--min-obs", dest="min_observations", type=int)
+    p.add_argument("--meses", dest="months_filter", type=meses, help="p. ej. 4,5")
+    p.add_argument("--salida", dest="salida")
+    p.add_argument("--lista", action="store_true", default=None)
+
+    p = sub.add_parser("rare", help="especies raras del lugar observadas por el usuario")
+    p.add_argument("--taxon", dest="taxon_ids", type=int, nargs="+")
+    p.add_argument("--lugar", dest="place_id", type=int)
+    p.add_argument("--usuario", dest="username")
+    p.add_argument("--max-obs", dest="max_observaciones", type=int)
+    p.add_argument("--salida", dest="salida")
+    p.add_argument("--lista", action="store_true", default=None)
+
+    p = sub.add_parser("random", help="una especie aleatoria del lugar (no observada, con --usuario)")
+    p.add_argument("--taxon", dest="taxon_ids", type=int, nargs="+")
+    p.add_argument("--lugar", dest="place_id", type=int)
+    p.add_argument("--usuario", dest="username", nargs="+")
+    p.add_argument("--salida", dest="salida")
+    p.add_argument("--lista", action="store_true", default=None)
+
+    p = sub.add_parser("new-species", help="especies nuevas del usuario entre dos fechas")
+    p.add_argument("--usuario", dest="username")
+    p.add_argument("--desde", dest="fecha_inicio", help="dd/mm/aaaa")
+    p.add_argument("--hasta", dest="fecha_fin", help="dd/mm/aaaa")
+    p.add_argument("--motor", choices=["historial", "servidor", "comparar"])
+    p.add_argument("--salida", dest="salida")
+    p.add_argument("--lista", action="store_true", default=None)
+
+    p = sub.add_parser("distribution", help="países donde está presente cada taxón")
+    p.add_argument("--taxon", dest="taxon_ids", type=int, nargs="+")
+    p.add_argument("--min-obs", dest="min_observations", type=int)
+    p.add_argument("--meses", dest="months_filter", type=meses)
+    p.add_argument("--paises", dest="excel_path", help="Excel con columnas ID y Name")
+    p.add_argument("--carpeta", dest="carpeta_salida")
+
+    p = sub.add_parser("extract", help="exportar observaciones con coordenadas a CSV/Parquet")
+    p.add_argument("--taxon", dest="taxon_id", type=int)
+    p.add_argument("--lugar", dest="place_id", type=int)
+    p.add_argument("--max-obs", dest="max_obs", type=int)
+    p.add_argument("--formato", choices=["csv", "parquet"])
+    p.add_argument("--salida", dest="salida")
+
+    p = sub.add_parser("guide", help="guía en PDF de las especies no observadas (o de una sola con --especie)")
+    p.add_argument("--taxon", dest="taxon_id", type=int, help="taxón raíz de la guía")
+    p.add_argument("--especie", type=int, help="ficha de una sola especie")
+    p.add_argument("--lugar", dest="place_id", type=int)
+    p.add_argument("--usuario", dest="username")
+    p.add_argument("--min-obs", dest="min_observations", type=int)
+    p.add_argument("--shapefile", dest="shapefile")
+    p.add_argument("--salida", dest="salida", help="PDF de la guía")
+    p.add_argument("--carpeta", dest="carpeta_salida", help="carpeta de la ficha de --especie")
+    return parser
+
+
+def elegir_script(args):
+    if args.comando == "endemic":
+        if args.place_id_madre:
+            return "iNaturalist_especies_endemicas_metodo_extensivo.py"
+        if args.place_id:
+            args.place_id = args.place_id[0]
+        return "iNaturalist_especies_endemicas.py"
+    if args.comando == "unobserved":
+        if args.coordenadas:
+            args.latitude, args.longitude = args.coordenadas
+            return "iNaturalist_especies_no_observadas_coordenadas.py"
+        return "iNaturalist_especies_no_observadas.py"
+    if args.comando == "rare":
+        return "iNaturalist_especies_raras_mias.py"
+    if args.comando == "random":
+        return "iNaturalist_especie_aleatoria_no_observada.py" if args.username else "iNaturalist_especie_aleatoria.py"
+    if args.comando == "new-species":
+        return "iNaturalist_nuevas_especies_fechas.py"
+    if args.comando == "distribution":
+        return "iNaturalist_distribución_especie.py"
+    if args.comando == "extract":
+        return "iNaturalist_extractor_coordenadas.py"
+    if args.especie:
+        args.taxon_id = args.especie
+        return "iNaturalist_guía_especie.py"
+    return "iNaturalist_guía_automática.py"
+
+
+def main(argv=None):
+    args = crear_parser().parse_args(argv)
+    script = elegir_script(args)
+    # --refresh lo lee iNaturalist_cache directamente de sys.argv
+    PARAMETROS.update({k: v for k, v in vars(args).items() if k not in ("comando", "refresh", "coordenadas", "especie")})
+    if CARPETA not in sys.path:
+        sys.path.insert(0, CARPETA)
+    runpy.run_path(os.path.join(CARPETA, script), run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
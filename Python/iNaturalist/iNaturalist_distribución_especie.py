@@ -1,18 +1,21 @@
 import pandas as pd
-import requests
-import time
+
+from iNaturalist_parametros import parametro
+from iNaturalist_presencia import matriz_presencia
+from iNaturalist_taxones import resolver_taxones
 
 # =========================
 # Configuración
 # =========================
-taxon_ids = [133220]
-min_observations = 5
-months_filter = []  # [] = todos, [4,5] = abril y mayo
+taxon_ids = parametro("taxon_ids", [133220])
+min_observations = parametro("min_observations", 5)
+months_filter = parametro("months_filter", [])  # [] = todos, [4,5] = abril y mayo
+carpeta_salida = parametro("carpeta_salida", "C:/Users/jaime/Desktop/Aprendiendo Python/iNaturalist")
 
 # =========================
 # Leer Excel con países
 # =========================
-excel_path = "C:/Users/jaime/Desktop/Aprendiendo Python/iNaturalist/iNaturalist_países.xlsx"
+excel_path = parametro("excel_path", "C:/Users/jaime/Desktop/Aprendiendo Python/iNaturalist/iNaturalist_países.xlsx")
 df = pd.read_excel(excel_path)
 
 # Convertir a lista de diccionarios: [{"id": 7341, "name": "Afghanistan"}, ...]
@@ -38,66 +41,30 @@ else:
 # =========================
 # Obtener nombres científicos de los taxon_ids
 # =========================
+taxones = resolver_taxones(taxon_ids)
 taxon_names = {}
 for taxon_id in taxon_ids:
-    response = requests.get(f"https://api.inaturalist.org/v1/taxa/{taxon_id}")
-    if response.status_code == 200:
-        data = response.json()
-        results = data.get("results", [])
-        if results:
-            taxon_names[taxon_id] = results[0].get("name", str(taxon_id))
-        else:
-            taxon_names[taxon_id] = str(taxon_id)
+    taxon = taxones.get(taxon_id)
+    if taxon:
+        taxon_names[taxon_id] = taxon.get("name", str(taxon_id))
     else:
         taxon_names[taxon_id] = str(taxon_id)
-    time.sleep(0.2)  # evitar rate limit
 
 # =========================
 # Buscar presencia por país
 # =========================
-presence = {taxon_id: [] for taxon_id in taxon_ids}
+# Todos los países a la vez y todos los taxones en la misma pasada: matriz taxón × país
+print(f"\nBuscando {len(taxon_ids)} taxones en {len(countries)} países…")
+matriz = matriz_presencia(taxon_ids, countries, months_unique)
 
+presence = {taxon_id: [] for taxon_id in taxon_ids}
 for taxon_id in taxon_ids:
-    print(f"\nBuscando taxon {taxon_id} ({taxon_names[taxon_id]})…")
-
-    for country in countries:
-        params = {
-            "taxon_id": taxon_id,
-            "place_id": country["id"],
-            "verifiable": "true",
-            "per_page": 1
-        }
-
-        if months_unique:
-            params["month"] = ",".join(str(m) for m in months_unique)
-
-        response = requests.get(
-            "https://api.inaturalist.org/v1/observations/species_counts",
-            params=params
-        )
-
-        if response.status_code == 429:
-            print("Rate limit, esperando 10 s…")
-            time.sleep(10)
-            continue
-
-        if response.status_code != 200:
-            continue
-
-        data = response.json()
-        results = data.get("results", [])
-
-        if not results:
-            continue
-
-        count = results[0].get("count", 0)
-        if count >= min_observations:
-            presence[taxon_id].append({
-                "country": country["name"],
-                "observations": count
-            })
-
-        time.sleep(0.5)
+    fila = matriz.loc[taxon_id]
+    for country_name, count in fila[fila >= min_observations].items():
+        presence[taxon_id].append({
+            "country": country_name,
+            "observations": int(count)
+        })
 
 # =========================
 # Mostrar resultados
@@ -117,7 +84,7 @@ for taxon_id, countries_present in presence.items():
     species_name = taxon_names[taxon_id].replace(" ", "_")
 
     output_txt = (
-        f"C:/Users/jaime/Desktop/Aprendiendo Python/iNaturalist/"
+        f"{carpeta_salida}/"
         f"paises_{species_name}_min{min_observations}.txt"
     )
 
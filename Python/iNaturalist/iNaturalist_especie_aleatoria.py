@@ -1,74 +1,37 @@
-import requests
-from fpdf import FPDF
-from PIL import Image
-from io import BytesIO
-import os
 import random
-import time
+
+from iNaturalist_api import get_place_name
+from iNaturalist_fotos import precargar
+from iNaturalist_parametros import parametro
+from iNaturalist_taxones import species_counts
 
 # Configuración
-taxon_ids = [3]
-place_id = 146746
+taxon_ids = parametro("taxon_ids", [3])
+place_id = parametro("place_id", 146746)
 rows = []
-place_name = "Lugar desconocido"
 
 # Obtener nombre del lugar
-place_response = requests.get(f"https://api.inaturalist.org/v1/places/{place_id}")
-if place_response.status_code == 200:
-    place_data = place_response.json()
-    results = place_data.get("results", [])
-    if results:
-        place_name = results[0].get("display_name", place_name)
-else:
-    print(f"No se pudo obtener el nombre del lugar (status code {place_response.status_code})")
-
-# Obtener datos de iNaturalist con paginación, manejo de 429 y retrasos
-for taxon_id in taxon_ids:
-    page = 1
-    while True:
-        params = {
-            "place_id": place_id,
-            "taxon_id": taxon_id,
-            "verifiable": "true",
-            "per_page": 100,
-            "page": page
-        }
-        response = requests.get("https://api.inaturalist.org/v1/observations/species_counts", params=params)
-
-        if response.status_code == 429:
-            print("Demasiadas solicitudes, esperando 10 segundos antes de reintentar...")
-            time.sleep(10)
-            continue  # Reintenta la misma página luego de la pausa
-
-        if response.status_code != 200:
-            print(f"Request failed for taxon_id {taxon_id} page {page} with status code: {response.status_code}")
-            break
-
-        data = response.json()
-        results = data.get('results', [])
-        if not results:
-            break
-
-        for result in results:
-            taxon = result['taxon']
-            common_name = taxon.get('preferred_common_name', 'No common name')
-            scientific_name = taxon['name']
-            count = result['count']
-            photo_url = None
-            if taxon.get('default_photo'):
-                photo_url = taxon['default_photo'].get('medium_url', None)
-            rows.append({
-                "Common Name": common_name,
-                "Scientific Name": scientific_name,
-                "Observations": count,
-                "Photo URL": photo_url
-            })
-
-        if len(results) < 100:
-            break
-        page += 1
-
-        time.sleep(1)  # Pausa 1 segundo entre peticiones para no saturar la API
+place_name = get_place_name(place_id, "Lugar desconocido")
+
+# Obtener datos de iNaturalist con paginación (reintentos y ritmo en iNaturalist_api)
+params = {
+    "place_id": place_id,
+    "verifiable": "true"
+}
+for result in species_counts(params, taxon_ids):
+    taxon = result['taxon']
+    common_name = taxon.get('preferred_common_name', 'No common name')
+    scientific_name = taxon['name']
+    count = result['count']
+    photo_url = None
+    if taxon.get('default_photo'):
+        photo_url = taxon['default_photo'].get('medium_url', None)
+    rows.append({
+        "Common Name": common_name,
+        "Scientific Name": scientific_name,
+        "Observations": count,
+        "Photo URL": photo_url
+    })
 
 # Si no hay datos, salir
 if not rows:
@@ -78,6 +41,14 @@ if not rows:
 # Seleccionar especie aleatoria
 random_species = random.choice(rows)
 
+if parametro("lista", False):
+    for row in [random_species]:
+        print(f"{row['Scientific Name']} — {row['Common Name']} ({row['Observations']} obs.)")
+    exit()
+
+from fpdf import FPDF
+from io import BytesIO
+
 # Clase PDF
 class PDF(FPDF):
     def header(self):
@@ -95,12 +66,10 @@ class PDF(FPDF):
         # Descargar y agregar imagen
         if photo_url:
             try:
-                img_response = requests.get(photo_url)
-                if img_response.status_code == 200:
-                    image = Image.open(BytesIO(img_response.content))
-                    image_path = "temp.jpg"
-                    image.save(image_path)
-                    self.image(image_path, w=60)
+                img_bytes = fotos.get(photo_url)
+                if img_bytes:
+                    # Directamente desde memoria, sin fichero temporal
+                    self.image(BytesIO(img_bytes), w=60)
             except Exception:
                 self.set_font("Arial", "I", 10)
                 self.cell(0, 8, "Error al cargar imagen", ln=True)
@@ -110,6 +79,10 @@ class PDF(FPDF):
 
         self.ln(10)
 
+# Todas las fotos a la vez antes de maquetar, a la resolución justa para 60 mm de ancho
+fotos = precargar((row["Photo URL"] for row in [random_species]),
+                  caja=(60, None), perfil=parametro("perfil_fotos", "pantalla"))
+
 # Crear PDF
 pdf = PDF()
 pdf.set_auto_page_break(auto=True, margin=15)
@@ -120,9 +93,5 @@ pdf.add_species(random_species["Common Name"],
                 random_species["Photo URL"])
 
 # Guardar PDF
-pdf.output("C:/Users/jaime/Desktop/Aprendiendo Python/especie_aleatoria.pdf")
-print("PDF exportado correctamente con una especie aleatoria.")
-
-# Eliminar imagen temporal
-if os.path.exists("temp.jpg"):
-    os.remove("temp.jpg")
\ No newline at end of file
+pdf.output(parametro("salida", "C:/Users/jaime/Desktop/Aprendiendo Python/especie_aleatoria.pdf"))
+print("PDF exportado correctamente con una especie aleatoria.")
\ No newline at end of file
@@ -1,120 +1,28 @@
-import requests
-from fpdf import FPDF
-from PIL import Image
-from io import BytesIO
-import os
 import random
-import time
+
+from iNaturalist_api import get_place_name
+from iNaturalist_fotos import precargar
+from iNaturalist_parametros import parametro
+from iNaturalist_usuario import especies_no_observadas
 
 # Configuración
-taxon_ids = [3]  # Aves
-place_id = 146746  # Comunidad de Madrid
-username = "jaigol"
-rows = []
-place_name = "Lugar desconocido"
+taxon_ids = parametro("taxon_ids", [3])  # Aves
+place_id = parametro("place_id", 146746)  # Comunidad de Madrid
+username = parametro("username", "jaigol")  # o una lista de usuarios
+usuarios = [username] if isinstance(username, str) else list(username)
+username = ", ".join(usuarios)
 
 # Obtener nombre del lugar
-place_response = requests.get(f"https://api.inaturalist.org/v1/places/{place_id}")
-if place_response.status_code == 200:
-    place_data = place_response.json()
-    results = place_data.get("results", [])
-    if results:
-        place_name = results[0].get("display_name", place_name)
-else:
-    print(f"No se pudo obtener el nombre del lugar (status code {place_response.status_code})")
-
-# 1. Obtener especies del lugar (paginación y manejo 429)
-for taxon_id in taxon_ids:
-    page = 1
-    while True:
-        params = {
-            "place_id": place_id,
-            "taxon_id": taxon_id,
-            "verifiable": "true",
-            "per_page": 100,
-            "page": page
-        }
-        response = requests.get("https://api.inaturalist.org/v1/observations/species_counts", params=params)
-
-        if response.status_code == 429:
-            print("Demasiadas solicitudes, esperando 10 segundos antes de reintentar...")
-            time.sleep(10)
-            continue
-
-        if response.status_code != 200:
-            print(f"Request failed for taxon_id {taxon_id} page {page} with status code: {response.status_code}")
-            break
-
-        data = response.json()
-        results = data.get('results', [])
-        if not results:
-            break
-
-        for result in results:
-            taxon = result['taxon']
-            common_name = taxon.get('preferred_common_name', 'No common name')
-            scientific_name = taxon['name']
-            count = result['count']
-            photo_url = None
-            if taxon.get('default_photo'):
-                photo_url = taxon['default_photo'].get('medium_url', None)
-            rows.append({
-                "Common Name": common_name,
-                "Scientific Name": scientific_name,
-                "Observations": count,
-                "Photo URL": photo_url
-            })
-
-        if len(results) < 100:
-            break
-        page += 1
-        time.sleep(1)
+place_name = get_place_name(place_id, "Lugar desconocido")
+
+# 1-3. Especies del lugar que no ha observado ningún usuario (por Taxon ID, con ancestros)
+rows, filtered_rows = especies_no_observadas({"place_id": place_id, "verifiable": "true"}, taxon_ids, usuarios)
 
 # Salir si no hay especies
 if not rows:
     print("No se encontraron especies en el lugar.")
     exit()
 
-# 2. Obtener especies observadas por el usuario JaigoL (paginación y manejo 429)
-user_species = set()
-for taxon_id in taxon_ids:
-    page = 1
-    while True:
-        user_params = {
-            "user_login": username,
-            "verifiable": "true",
-            "taxon_id": taxon_id,
-            "per_page": 100,
-            "page": page
-        }
-        user_response = requests.get("https://api.inaturalist.org/v1/observations/species_counts", params=user_params)
-
-        if user_response.status_code == 429:
-            print("Demasiadas solicitudes usuario, esperando 10 segundos antes de reintentar...")
-            time.sleep(10)
-            continue
-
-        if user_response.status_code != 200:
-            print(f"Error al obtener especies del usuario para taxon_id {taxon_id}.")
-            break
-
-        user_data = user_response.json()
-        results = user_data.get('results', [])
-        if not results:
-            break
-
-        for result in results:
-            taxon = result['taxon']
-            user_species.add(taxon['name'])
-
-        if len(results) < 100:
-            break
-        page += 1
-        time.sleep(1)
-
-# 3. Filtrar especies no observadas por el usuario
-filtered_rows = [row for row in rows if row["Scientific Name"] not in user_species]
-
 if not filtered_rows:
     print("Ya has observado todas las especies en este lugar.")
     exit()
@@ -122,6 +30,14 @@ if not filtered_rows:
 # 4. Seleccionar especie aleatoria de las no observadas
 random_species = random.choice(filtered_rows)
 
+if parametro("lista", False):
+    for row in [random_species]:
+        print(f"{row['Scientific Name']} — {row['Common Name']} ({row['Observations']} obs.)")
+    exit()
+
+from fpdf import FPDF
+from io import BytesIO
+
 # 5. Crear PDF
 class PDF(FPDF):
     def header(self):
@@ -138,12 +54,10 @@ class PDF(FPDF):
 
         if photo_url:
             try:
-                img_response = requests.get(photo_url)
-                if img_response.status_code == 200:
-                    image = Image.open(BytesIO(img_response.content))
-                    image_path = "temp.jpg"
-                    image.save(image_path)
-                    self.image(image_path, w=60)
+                img_bytes = fotos.get(photo_url)
+                if img_bytes:
+                    # Directamente desde memoria, sin fichero temporal
+                    self.image(BytesIO(img_bytes), w=60)
             except Exception:
                 self.set_font("Arial", "I", 10)
                 self.cell(0, 8, "Error al cargar imagen", ln=True)
@@ -153,6 +67,10 @@ class PDF(FPDF):
 
         self.ln(10)
 
+# Todas las fotos a la vez antes de maquetar, a la resolución justa para 60 mm de ancho
+fotos = precargar((row["Photo URL"] for row in [random_species]),
+                  caja=(60, None), perfil=parametro("perfil_fotos", "pantalla"))
+
 # Crear y exportar el PDF
 pdf = PDF()
 pdf.set_auto_page_break(auto=True, margin=15)
@@ -162,9 +80,5 @@ pdf.add_species(random_species["Common Name"],
                 random_species["Observations"],
                 random_species["Photo URL"])
 
-pdf.output("C:/Users/jaime/Desktop/Aprendiendo Python/especie_aleatoria_nueva.pdf")
-print("PDF exportado correctamente con una especie aleatoria no observada por JaigoL.")
-
-# Eliminar imagen temporal
-if os.path.exists("temp.jpg"):
-    os.remove("temp.jpg")
\ No newline at end of file
+pdf.output(parametro("salida", "C:/Users/jaime/Desktop/Aprendiendo Python/especie_aleatoria_nueva.pdf"))
+print(f"PDF exportado correctamente con una especie aleatoria no observada por {username}.")
\ No newline at end of file
@@ -1,15 +1,13 @@
-import requests
-from fpdf import FPDF
-from PIL import Image
-from io import BytesIO
-import os
-import time
+from iNaturalist_api import get_place_name
+from iNaturalist_fotos import precargar
+from iNaturalist_parametros import parametro
+from iNaturalist_taxones import species_counts
 
 # =========================
 # Configuración
 # =========================
-taxon_ids = [48460]  # Ej: Aves
-place_id = 30000     # ID del lugar en iNaturalist
+taxon_ids = parametro("taxon_ids", [48460])  # Ej: Aves
+place_id = parametro("place_id", 30000)     # ID del lugar en iNaturalist
 rows = []
 
 # =========================
@@ -44,67 +42,32 @@ def clean_text(text):
 # =========================
 # Obtener nombre del lugar
 # =========================
-place_name = "lugar desconocido"
-place_response = requests.get(f"https://api.inaturalist.org/v1/places/{place_id}")
-if place_response.status_code == 200:
-    place_data = place_response.json()
-    results = place_data.get("results", [])
-    if results:
-        place_name = results[0].get("display_name", place_name)
-else:
-    print(f"No se pudo obtener el nombre del lugar (status code {place_response.status_code})")
+place_name = get_place_name(place_id)
 
 # =========================
 # 1. Obtener especies endémicas del lugar
 # =========================
-for taxon_id in taxon_ids:
-    page = 1
-    while True:
-        params = {
-            "place_id": place_id,
-            "taxon_id": taxon_id,
-            "verifiable": "true",
-            "endemic": "true",
-            "per_page": 100,
-            "page": page
-        }
-
-        response = requests.get("https://api.inaturalist.org/v1/observations/species_counts", params=params)
-
-        if response.status_code == 429:
-            print("Demasiadas solicitudes, esperando 10 segundos antes de reintentar...")
-            time.sleep(10)
-            continue
-
-        if response.status_code != 200:
-            print(f"Request failed for taxon_id {taxon_id} page {page} with status code: {response.status_code}")
-            break
-
-        data = response.json()
-        results = data.get('results', [])
-        if not results:
-            break
-
-        for result in results:
-            taxon = result.get('taxon', {})
-            common_name = taxon.get('preferred_common_name', 'No common name')
-            scientific_name = taxon.get('name', 'Unknown')
-            taxon_id_actual = taxon.get('id')
-            photo_url = None
-            if taxon.get('default_photo'):
-                photo_url = taxon['default_photo'].get('medium_url', None)
-            rows.append({
-                "Taxon ID": taxon_id_actual,
-                "Common Name": common_name,
-                "Scientific Name": scientific_name,
-                "Observations": result.get('count', 0),
-                "Photo URL": photo_url
-            })
-
-        if len(results) < 100:
-            break
-        page += 1
-        time.sleep(1)
+params = {
+    "place_id": place_id,
+    "verifiable": "true",
+    "endemic": "true"
+}
+
+for result in species_counts(params, taxon_ids):
+    taxon = result.get('taxon', {})
+    common_name = taxon.get('preferred_common_name', 'No common name')
+    scientific_name = taxon.get('name', 'Unknown')
+    taxon_id_actual = taxon.get('id')
+    photo_url = None
+    if taxon.get('default_photo'):
+        photo_url = taxon['default_photo'].get('medium_url', None)
+    rows.append({
+        "Taxon ID": taxon_id_actual,
+        "Common Name": common_name,
+        "Scientific Name": scientific_name,
+        "Observations": result.get('count', 0),
+        "Photo URL": photo_url
+    })
 
 if not rows:
     print(f"No se encontraron especies endémicas en {place_name}.")
@@ -112,6 +75,14 @@ if not rows:
 
 total_species = len(rows)
 
+if parametro("lista", False):
+    for row in rows:
+        print(f"{row['Scientific Name']} — {row['Common Name']} ({row['Observations']} obs.)")
+    exit()
+
+from fpdf import FPDF
+from io import BytesIO
+
 # =========================
 # 2. Crear PDF con maquetación vertical (igual que tu script anterior)
 # =========================
@@ -130,7 +101,7 @@ class PDF(FPDF):
         )
         self.ln(5)
 
-    def add_species(self, common_name, scientific_name, count, photo_url, index):
+    def add_species(self, common_name, scientific_name, count, photo_url):
         self.set_font("Helvetica", "B", 12)
         self.cell(0, 10, clean_text(common_name), ln=True)
         self.set_font("Helvetica", "", 11)
@@ -139,13 +110,11 @@ class PDF(FPDF):
 
         if photo_url:
             try:
-                img_response = requests.get(photo_url, timeout=10)
-                if img_response.status_code == 200:
-                    image = Image.open(BytesIO(img_response.content)).convert("RGB")
-                    image_path = f"temp_{index}.jpg"
-                    image.save(image_path)
+                img_bytes = fotos.get(photo_url)
+                if img_bytes:
+                    # Directamente desde memoria, sin fichero temporal
                     try:
-                        self.image(image_path, w=60)
+                        self.image(BytesIO(img_bytes), w=60)
                     except Exception:
                         self.set_font("Helvetica", "I", 10)
                         self.cell(0, 8, "Error al insertar imagen en el PDF", ln=True)
@@ -158,26 +127,19 @@ class PDF(FPDF):
 
         self.ln(10)
 
+# Todas las fotos a la vez antes de maquetar, a la resolución justa para 60 mm de ancho
+fotos = precargar((row["Photo URL"] for row in rows),
+                  caja=(60, None), perfil=parametro("perfil_fotos", "pantalla"))
+
 # Crear y exportar el PDF
 pdf = PDF(total_species, place_name)
 pdf.set_auto_page_break(auto=True, margin=15)
 pdf.add_page()
 
-for idx, row in enumerate(rows):
-    pdf.add_species(row["Common Name"], row["Scientific Name"], row["Observations"], row["Photo URL"], idx)
+for row in rows:
+    pdf.add_species(row["Common Name"], row["Scientific Name"], row["Observations"], row["Photo URL"])
 
-output_path = "C:/Users/jaime/Desktop/Aprendiendo Python/especies_endemicas.pdf"
+output_path = parametro("salida", "C:/Users/jaime/Desktop/Aprendiendo Python/especies_endemicas.pdf")
 pdf.output(output_path)
 
-print(f"PDF exportado correctamente con {total_species} especies endémicas en {place_name}.")
-
-# =========================
-# 3. Eliminar imágenes temporales
-# =========================
-for idx in range(total_species):
-    temp_file = f"temp_{idx}.jpg"
-    if os.path.exists(temp_file):
-        try:
-            os.remove(temp_file)
-        except Exception:
-            pass
\ No newline at end of file
+print(f"PDF exportado correctamente con {total_species} especies endémicas en {place_name}.")
\ No newline at end of file
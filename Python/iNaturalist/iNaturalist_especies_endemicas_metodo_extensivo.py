@@ -1,18 +1,18 @@
-import requests
-from fpdf import FPDF
-from PIL import Image
-from io import BytesIO
-import os
-import time
+import numpy as np
+
+from iNaturalist_api import get_place_name
+from iNaturalist_fotos import precargar
+from iNaturalist_parametros import parametro
+from iNaturalist_presencia import especies_por_lugar
 
 # =========================
 # Configuración
 # =========================
-taxon_ids = [48460]  # Ej: Aves
-place_id_hija = 169075  # Comunidad de Madrid
-place_id_madre = 10543  # Península Ibérica
-min_observations = 1    # mínimo de observaciones para considerar la especie
-error_observaciones = 2  # margen de error de observaciones
+taxon_ids = parametro("taxon_ids", [48460])  # Ej: Aves
+place_id_hija = parametro("place_id", 169075)  # Comunidad de Madrid (o una lista: p. ej. todas las provincias)
+place_id_madre = parametro("place_id_madre", 10543)  # Península Ibérica
+min_observations = parametro("min_observations", 1)    # mínimo de observaciones para considerar la especie
+error_observaciones = parametro("error_observaciones", 2)  # margen de error de observaciones
 
 # =========================
 # Función para limpiar caracteres problemáticos
@@ -30,97 +30,61 @@ def clean_text(text):
     return text
 
 # =========================
-# Obtener nombre del lugar
+# Obtener nombre de los lugares
 # =========================
-place_name = "lugar desconocido"
-place_response = requests.get(f"https://api.inaturalist.org/v1/places/{place_id_hija}")
-if place_response.status_code == 200:
-    place_data = place_response.json()
-    results = place_data.get("results", [])
-    if results:
-        place_name = results[0].get("display_name", place_name)
-else:
-    print(f"No se pudo obtener el nombre del lugar (status code {place_response.status_code})")
+places_hija = list(place_id_hija) if isinstance(place_id_hija, (list, tuple)) else [place_id_hija]
+nombres_hija = {pid: get_place_name(pid) for pid in places_hija}
+place_name = ", ".join(nombres_hija.values())
 
 # =========================
-# Función para obtener especies de un lugar
+# Especies de madre e hijas a la vez: matriz taxón × lugar
 # =========================
-def obtener_especies(place_id):
-    especies = {}
-    for taxon_id in taxon_ids:
-        page = 1
-        while True:
-            params = {
-                "place_id": place_id,
-                "taxon_id": taxon_id,
-                "verifiable": "true",
-                "per_page": 100,
-                "page": page
-            }
-            response = requests.get("https://api.inaturalist.org/v1/observations/species_counts", params=params)
-            if response.status_code == 429:
-                time.sleep(10)
-                continue
-            if response.status_code != 200:
-                break
-
-            data = response.json()
-            results = data.get('results', [])
-            if not results:
-                break
-
-            for result in results:
-                count = result.get('count', 0)
-                taxon = result.get('taxon', {})
-                taxon_id_actual = taxon.get('id')
-                if taxon_id_actual is None:
-                    continue
-                especies[taxon_id_actual] = {
-                    "Common Name": taxon.get('preferred_common_name', 'No common name'),
-                    "Scientific Name": taxon.get('name', 'Unknown'),
-                    "Observations": count,
-                    "Photo URL": taxon['default_photo']['medium_url'] if taxon.get('default_photo') else None
-                }
-
-            if len(results) < 100:
-                break
-            page += 1
-            time.sleep(1)
-    return especies
+print(f"Obteniendo especies de la madre y de {len(places_hija)} lugares hija...")
+matriz, taxones = especies_por_lugar(taxon_ids, [place_id_madre] + places_hija, {"verifiable": "true"})
+if place_id_madre not in matriz.columns:
+    print("No se pudieron descargar todas las especies del lugar madre; no se puede comparar.")
+    exit()
+# Los lugares hija que no se pudieron descargar completos no se comparan
+places_hija = [pid for pid in places_hija if pid in matriz.columns]
+print(f"{int((matriz[place_id_madre] > 0).sum())} especies en madre")
 
 # =========================
-# Obtener especies de madre e hija
+# Filtrar especies cuya cantidad en cada hija está dentro del margen de madre
 # =========================
-print("Obteniendo especies de la madre...")
-especies_madre = obtener_especies(place_id_madre)
-print(f"{len(especies_madre)} especies en madre")
+# Regla abs(madre - hija) <= error evaluada a la vez para todas las hijas
+madre = matriz[place_id_madre].to_numpy()
+hijas = matriz[places_hija].to_numpy()
+en_ambas = (madre[:, None] > 0) & (hijas > 0)
+cumple = en_ambas & (np.abs(madre[:, None] - hijas) <= error_observaciones) & (madre[:, None] >= min_observations)
 
-print("Obteniendo especies de la hija...")
-especies_hija = obtener_especies(place_id_hija)
-print(f"{len(especies_hija)} especies en hija")
-
-# =========================
-# Filtrar especies cuya cantidad en hija está dentro del margen de madre
-# =========================
 filtered_rows = []
-for tid, madre_info in especies_madre.items():
-    count_madre = madre_info["Observations"]
-    hija_info = especies_hija.get(tid)
-    if hija_info:
-        count_hija = hija_info["Observations"]
-        if abs(count_madre - count_hija) <= error_observaciones and count_madre >= min_observations:
-            filtered_rows.append({
-                "Taxon ID": tid,
-                "Common Name": clean_text(madre_info["Common Name"]),
-                "Scientific Name": clean_text(madre_info["Scientific Name"]),
-                "Observations Madre": count_madre,
-                "Observations Hija": count_hija,
-                "Photo URL": madre_info["Photo URL"]
-            })
+for j, pid in enumerate(places_hija):
+    print(f"{nombres_hija[pid]}: {int(cumple[:, j].sum())} especies cumplen la condición")
+    for i in np.flatnonzero(cumple[:, j]):
+        tid = int(matriz.index[i])
+        taxon = taxones[tid]
+        filtered_rows.append({
+            "Taxon ID": tid,
+            "Place": nombres_hija[pid],
+            "Common Name": clean_text(taxon.get('preferred_common_name', 'No common name')),
+            "Scientific Name": clean_text(taxon.get('name', 'Unknown')),
+            "Observations Madre": int(madre[i]),
+            "Observations Hija": int(hijas[i, j]),
+            "Photo URL": (taxon.get('default_photo') or {}).get('medium_url')
+        })
 
 total_species = len(filtered_rows)
 print(f"{total_species} especies cumplen la condición")
 
+if parametro("lista", False):
+    for row in filtered_rows:
+        print(f"{row['Place']}: {row['Scientific Name']} — {row['Common Name']} "
+              f"(madre {row['Observations Madre']}, hija {row['Observations Hija']})")
+    exit()
+
+from fpdf import FPDF
+from io import BytesIO
+
 # =========================
 # Crear PDF
 # =========================
@@ -134,22 +98,22 @@ class PDF(FPDF):
         self.multi_cell(0, 10, f"Especies con todas las observaciones en hija dentro del margen de madre ({self.total_species} especies)", align="C")
         self.ln(5)
 
-    def add_species(self, row, index):
+    def add_species(self, row):
         self.set_font("Helvetica", "B", 12)
         self.cell(0, 10, row["Common Name"], ln=True)
         self.set_font("Helvetica", "", 11)
         self.cell(0, 8, f"Nombre científico: {row['Scientific Name']}", ln=True)
+        if len(places_hija) > 1:
+            self.cell(0, 8, f"Lugar: {clean_text(row['Place'])}", ln=True)
         self.cell(0, 8, f"Observaciones madre: {row['Observations Madre']}, hija: {row['Observations Hija']}", ln=True)
 
         if row["Photo URL"]:
             try:
-                img_response = requests.get(row["Photo URL"], timeout=10)
-                if img_response.status_code == 200:
-                    image = Image.open(BytesIO(img_response.content)).convert("RGB")
-                    image_path = f"temp_{index}.jpg"
-                    image.save(image_path)
+                img_bytes = fotos.get(row["Photo URL"])
+                if img_bytes:
+                    # Directamente desde memoria, sin fichero temporal
                     try:
-                        self.image(image_path, w=60)
+                        self.image(BytesIO(img_bytes), w=60)
                     except Exception:
                         self.set_font("Helvetica", "I", 10)
                         self.cell(0, 8, "Error al insertar imagen en el PDF", ln=True)
@@ -162,19 +126,17 @@ class PDF(FPDF):
 
         self.ln(10)
 
+# Todas las fotos a la vez antes de maquetar, a la resolución justa para 60 mm de ancho
+fotos = precargar((row["Photo URL"] for row in filtered_rows),
+                  caja=(60, None), perfil=parametro("perfil_fotos", "pantalla"))
+
 pdf = PDF(total_species)
 pdf.set_auto_page_break(auto=True, margin=15)
 pdf.add_page()
 
-for idx, row in enumerate(filtered_rows):
-    pdf.add_species(row, idx)
+for row in filtered_rows:
+    pdf.add_species(row)
 
-output_path = "C:/Users/jaime/Desktop/Aprendiendo Python/especies_hija_vs_madre.pdf"
+output_path = parametro("salida", "C:/Users/jaime/Desktop/Aprendiendo Python/especies_hija_vs_madre.pdf")
 pdf.output(output_path)
-print(f"PDF exportado correctamente con {total_species} especies endémicas en {place_name} (método extensivo).")
-
-# Eliminar imágenes temporales
-for idx in range(total_species):
-    temp_file = f"temp_{idx}.jpg"
-    if os.path.exists(temp_file):
-        os.remove(temp_file)
\ No newline at end of file
+print(f"PDF exportado correctamente con {total_species} especies endémicas en {place_name} (método extensivo).")
\ No newline at end of file
@@ -1,20 +1,19 @@
-import requests
-from fpdf import FPDF
-from PIL import Image
-from io import BytesIO
-import os
-import time
+from iNaturalist_api import get_place_name
+from iNaturalist_fotos import precargar
+from iNaturalist_parametros import parametro
+from iNaturalist_usuario import especies_no_observadas
 
 # =========================
 # Configuración
 # =========================
-taxon_ids = [48460]
-place_id = 192426
-username = "jaigol"
-min_observations = 3   # mínimo de observaciones
-months_filter = []    # lista de meses: [] = todos, [10] = octubre, [4,5] = abril y mayo
+taxon_ids = parametro("taxon_ids", [48460])
+place_id = parametro("place_id", 192426)
+username = parametro("username", "jaigol")  # o una lista de usuarios: especies que no ha visto ninguno
+min_observations = parametro("min_observations", 3)   # mínimo de observaciones
+months_filter = parametro("months_filter", [])    # lista de meses: [] = todos, [10] = octubre, [4,5] = abril y mayo
 
-rows = []
+usuarios = [username] if isinstance(username, str) else list(username)
+username = ", ".join(usuarios)
 
 # Nombres de meses en español (índice coincide con número de mes)
 months_es = [
@@ -36,130 +35,35 @@ else:
 # =========================
 # Obtener nombre del lugar
 # =========================
-place_name = "lugar desconocido"
-place_response = requests.get(f"https://api.inaturalist.org/v1/places/{place_id}")
-if place_response.status_code == 200:
-    place_data = place_response.json()
-    results = place_data.get("results", [])
-    if results:
-        place_name = results[0].get("display_name", place_name)
-else:
-    print(f"No se pudo obtener el nombre del lugar (status code {place_response.status_code})")
+place_name = get_place_name(place_id)
 
 # =========================
-# 1. Obtener especies del lugar (con opción de filtrar por mes)
+# 1-3. Especies del lugar (con opción de filtrar por mes) que no ha observado ningún usuario
 # =========================
-for taxon_id in taxon_ids:
-    page = 1
-    while True:
-        params = {
-            "place_id": place_id,
-            "taxon_id": taxon_id,
-            "verifiable": "true",
-            "per_page": 100,
-            "page": page
-        }
-        if months_unique:
-            params["month"] = ",".join(str(m) for m in months_unique)
-
-        response = requests.get("https://api.inaturalist.org/v1/observations/species_counts", params=params)
-
-        if response.status_code == 429:
-            print("Demasiadas solicitudes, esperando 10 segundos antes de reintentar...")
-            time.sleep(10)
-            continue
-
-        if response.status_code != 200:
-            print(f"Request failed for taxon_id {taxon_id} page {page} with status code: {response.status_code}")
-            break
-
-        data = response.json()
-        results = data.get('results', [])
-        if not results:
-            break
-
-        for result in results:
-            count = result.get('count', 0)
-            if count >= min_observations:
-                taxon = result.get('taxon', {})
-                common_name = taxon.get('preferred_common_name', 'No common name')
-                scientific_name = taxon.get('name', 'Unknown')
-                taxon_id_actual = taxon.get('id')  # Usamos ID para comparar de forma robusta
-                photo_url = None
-                if taxon.get('default_photo'):
-                    photo_url = taxon['default_photo'].get('medium_url', None)
-                rows.append({
-                    "Taxon ID": taxon_id_actual,
-                    "Common Name": common_name,
-                    "Scientific Name": scientific_name,
-                    "Observations": count,
-                    "Photo URL": photo_url
-                })
-
-        if len(results) < 100:
-            break
-        page += 1
-        time.sleep(1)
+# La lista de vida se pide SIN filtrar por mes, para excluir cualquier especie que ya tengas,
+# e incluye los ancestros de cada taxón: una subespecie observada cuenta como su especie.
+rows, filtered_rows = especies_no_observadas(
+    {"place_id": place_id, "verifiable": "true"}, taxon_ids, usuarios, min_observations, months_unique
+)
 
 if not rows:
     print(f"No se encontraron especies en {place_name} ({months_text}) con al menos {min_observations} observaciones.")
     exit()
 
-# =========================
-# 2. Obtener especies observadas por el usuario (SIN filtrar por mes, para excluir cualquier especie que ya tengas)
-# =========================
-# Nota: dejamos fuera 'month' aquí para evitar que una observación tuya en otro mes no sea detectada.
-user_species_ids = set()
-
-for taxon_id in taxon_ids:
-    page = 1
-    while True:
-        user_params = {
-            "user_login": username,
-            "verifiable": "true",
-            "taxon_id": taxon_id,
-            "per_page": 100,
-            "page": page
-            # intentionally no "month" here: queremos conocer todas tus especies
-        }
-
-        user_response = requests.get("https://api.inaturalist.org/v1/observations/species_counts", params=user_params)
-
-        if user_response.status_code == 429:
-            print("Demasiadas solicitudes al obtener especies del usuario, esperando 10 segundos...")
-            time.sleep(10)
-            continue
-
-        if user_response.status_code != 200:
-            print(f"Error al obtener especies del usuario para taxon_id {taxon_id}. Status: {user_response.status_code}")
-            break
-
-        user_data = user_response.json()
-        user_results = user_data.get('results', [])
-        if not user_results:
-            break
-
-        for result in user_results:
-            taxon = result.get('taxon', {})
-            tid = taxon.get('id')
-            if tid is not None:
-                user_species_ids.add(tid)
-
-        if len(user_results) < 100:
-            break
-        page += 1
-        time.sleep(1)
-
-# =========================
-# 3. Filtrar especies no observadas por el usuario (comparando por Taxon ID)
-# =========================
-filtered_rows = [row for row in rows if row["Taxon ID"] not in user_species_ids]
 total_species = len(filtered_rows)
 
 if total_species == 0:
     print(f"Ya has observado todas las especies en {place_name} ({months_text}) con ese mínimo de observaciones.")
     exit()
 
+if parametro("lista", False):
+    for row in filtered_rows:
+        print(f"{row['Scientific Name']} — {row['Common Name']} ({row['Observations']} obs.)")
+    exit()
+
+from fpdf import FPDF
+from io import BytesIO
+
 # =========================
 # 4. Crear PDF
 # =========================
@@ -179,7 +83,7 @@ class PDF(FPDF):
         )
         self.ln(5)
 
-    def add_species(self, common_name, scientific_name, count, photo_url, index):
+    def add_species(self, common_name, scientific_name, count, photo_url):
         self.set_font("Arial", "B", 12)
         self.cell(0, 10, common_name, ln=True)
         self.set_font("Arial", "", 11)
@@ -188,14 +92,11 @@ class PDF(FPDF):
 
         if photo_url:
             try:
-                img_response = requests.get(photo_url, timeout=10)
-                if img_response.status_code == 200:
-                    image = Image.open(BytesIO(img_response.content)).convert("RGB")
-                    image_path = f"temp_{index}.jpg"
-                    image.save(image_path)
-                    # Insertar imagen y manejar saltos de página automáticos
+                img_bytes = fotos.get(photo_url)
+                if img_bytes:
+                    # Directamente desde memoria, sin fichero temporal
                     try:
-                        self.image(image_path, w=60)
+                        self.image(BytesIO(img_bytes), w=60)
                     except Exception:
                         # En caso de problema al insertar la imagen, mostramos texto en su lugar
                         self.set_font("Arial", "I", 10)
@@ -209,26 +110,19 @@ class PDF(FPDF):
 
         self.ln(10)
 
+# Todas las fotos a la vez antes de maquetar, a la resolución justa para 60 mm de ancho
+fotos = precargar((row["Photo URL"] for row in filtered_rows),
+                  caja=(60, None), perfil=parametro("perfil_fotos", "pantalla"))
+
 # Crear y exportar el PDF
 pdf = PDF(total_species, months_text)
 pdf.set_auto_page_break(auto=True, margin=15)
 pdf.add_page()
 
-for idx, row in enumerate(filtered_rows):
-    pdf.add_species(row["Common Name"], row["Scientific Name"], row["Observations"], row["Photo URL"], idx)
+for row in filtered_rows:
+    pdf.add_species(row["Common Name"], row["Scientific Name"], row["Observations"], row["Photo URL"])
 
-output_path = "C:/Users/jaime/Desktop/Aprendiendo Python/especies_no_observadas.pdf"
+output_path = parametro("salida", "C:/Users/jaime/Desktop/Aprendiendo Python/especies_no_observadas.pdf")
 pdf.output(output_path)
 
-print(f"PDF exportado correctamente con {total_species} especies no observadas por {username} en {place_name} ({months_text}), con al menos {min_observations} observaciones.")
-
-# =========================
-# Eliminar imágenes temporales
-# =========================
-for idx in range(total_species):
-    temp_file = f"temp_{idx}.jpg"
-    if os.path.exists(temp_file):
-        try:
-            os.remove(temp_file)
-        except Exception:
-            pass
\ No newline at end of file
+print(f"PDF exportado correctamente con {total_species} especies no observadas por {username} en {place_name} ({months_text}), con al menos {min_observations} observaciones.")
\ No newline at end of file
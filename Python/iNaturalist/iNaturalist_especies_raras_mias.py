@@ -1,121 +1,82 @@
-import requests
-from fpdf import FPDF
-from PIL import Image
-from io import BytesIO
-import os
-import time
+import numpy as np
+
+from iNaturalist_api import get_place_name
+from iNaturalist_fotos import precargar
+from iNaturalist_parametros import parametro
+from iNaturalist_taxones import species_counts, taxonomia
 
 # Configuración
-taxon_ids = [48460]
-place_id = 10543
-username = "jaigol"
-max_observaciones = 10  # 🔍 Sólo mostrar especies con ≤ este número de observaciones en total en el lugar
+taxon_ids = parametro("taxon_ids", [48460])
+place_id = parametro("place_id", 10543)
+username = parametro("username", "jaigol")
+max_observaciones = parametro("max_observaciones", 10)  # 🔍 Sólo mostrar especies con ≤ este número de observaciones en total en el lugar
 rows = []
+tax = taxonomia()
 
 # Obtener nombre del lugar
-place_name = "lugar desconocido"
-place_response = requests.get(f"https://api.inaturalist.org/v1/places/{place_id}")
-if place_response.status_code == 200:
-    place_data = place_response.json()
-    results = place_data.get("results", [])
-    if results:
-        place_name = results[0].get("display_name", place_name)
-else:
-    print(f"No se pudo obtener el nombre del lugar (status code {place_response.status_code})")
+place_name = get_place_name(place_id)
 
 # 1. Obtener especies del lugar (con paginación)
-for taxon_id in taxon_ids:
-    page = 1
-    while True:
-        params = {
-            "place_id": place_id,
-            "taxon_id": taxon_id,
-            "verifiable": "true",
-            "per_page": 100,
-            "page": page
-        }
-        response = requests.get("https://api.inaturalist.org/v1/observations/species_counts", params=params)
-
-        if response.status_code == 429:
-            print("Demasiadas solicitudes, esperando 10 segundos antes de reintentar...")
-            time.sleep(10)
-            continue  # Reintenta la misma página después de la pausa
-
-        if response.status_code != 200:
-            print(f"Request failed for taxon_id {taxon_id} page {page} with status code: {response.status_code}")
-            break
-
-        data = response.json()
-        results = data.get('results', [])
-        if not results:
-            break
-
-        for result in results:
-            taxon = result['taxon']
-            common_name = taxon.get('preferred_common_name', 'No common name')
-            scientific_name = taxon['name']
-            count = result['count']
-            photo_url = (taxon.get('default_photo') or {}).get('medium_url')
-            rows.append({
-                "Common Name": common_name,
-                "Scientific Name": scientific_name,
-                "Observations": count,
-                "Photo URL": photo_url
-            })
-
-        if len(results) < 100:
-            break
-        page += 1
-
-        time.sleep(1)
+params = {
+    "place_id": place_id,
+    "verifiable": "true"
+}
+taxones_lugar = []
+for result in species_counts(params, taxon_ids):
+    taxon = result['taxon']
+    taxones_lugar.append(taxon)
+    common_name = taxon.get('preferred_common_name', 'No common name')
+    scientific_name = taxon['name']
+    count = result['count']
+    photo_url = (taxon.get('default_photo') or {}).get('medium_url')
+    rows.append({
+        "Taxon ID": taxon['id'],
+        "Common Name": common_name,
+        "Scientific Name": scientific_name,
+        "Observations": count,
+        "Photo URL": photo_url
+    })
+# Todos los taxones a la taxonomía local de una vez (una sola transacción)
+tax.registrar(taxones_lugar)
 
 if not rows:
     print("No se encontraron especies en el lugar.")
     exit()
 
-# 2. Obtener especies que TÚ has observado en ese lugar (ya paginado)
-user_species = set()
-for taxon_id in taxon_ids:
-    page = 1
-    while True:
-        user_params = {
-            "user_login": username,
-            "verifiable": "true",
-            "place_id": place_id,
-            "taxon_id": taxon_id,
-            "per_page": 100,
-            "page": page
-        }
-        user_response = requests.get("https://api.inaturalist.org/v1/observations/species_counts", params=user_params)
-
-        if user_response.status_code != 200:
-            print(f"Error al obtener especies del usuario para taxon_id {taxon_id}.")
-            break
-
-        user_data = user_response.json()
-        user_results = user_data.get('results', [])
-        if not user_results:
-            break
-
-        for result in user_results:
-            taxon = result['taxon']
-            user_species.add(taxon['name'])
-
-        if len(user_results) < 100:
-            break
-        page += 1
-
-# 3. Filtrar especies raras que tú hayas observado
-filtered_rows = [
-    row for row in rows
-    if row["Scientific Name"] in user_species and row["Observations"] <= max_observaciones
-]
+# 2. Obtener especies que TÚ has observado en ese lugar (por Taxon ID)
+user_species_ids = []
+taxones_usuario = []
+user_params = {
+    "user_login": username,
+    "verifiable": "true",
+    "place_id": place_id
+}
+for result in species_counts(user_params, taxon_ids):
+    taxon = result['taxon']
+    taxones_usuario.append(taxon)
+    user_species_ids.append(taxon['id'])
+tax.registrar(taxones_usuario)
+
+# 3. Filtrar especies raras que tú hayas observado: ambos lados subidos a especie
+# (una subespecie tuya cuenta para la especie del lugar) y comparados como enteros
+row_species = tax.a_especie([row["Taxon ID"] for row in rows])
+observed = np.isin(row_species, tax.a_especie(user_species_ids))
+counts = np.array([row["Observations"] for row in rows])
+filtered_rows = [rows[i] for i in np.flatnonzero(observed & (counts <= max_observaciones))]
 total_species = len(filtered_rows)
 
 if total_species == 0:
     print(f"No has observado especies raras (≤ {max_observaciones} obs.) en este lugar.")
     exit()
 
+if parametro("lista", False):
+    for row in filtered_rows:
+        print(f"{row['Scientific Name']} — {row['Common Name']} ({row['Observations']} obs.)")
+    exit()
+
+from fpdf import FPDF
+from io import BytesIO
+
 # 4. Crear PDF
 class PDF(FPDF):
     def __init__(self, total_species, max_obs, *args, **kwargs):
@@ -131,7 +92,7 @@ class PDF(FPDF):
             f"Total: {self.total_species} especies", align="C")
         self.ln(5)
 
-    def add_species(self, common_name, scientific_name, count, photo_url, index):
+    def add_species(self, common_name, scientific_name, count, photo_url):
         self.set_font("Arial", "B", 12)
         self.cell(0, 10, common_name, ln=True)
         self.set_font("Arial", "", 11)
@@ -140,12 +101,10 @@ class PDF(FPDF):
 
         if photo_url:
             try:
-                img_response = requests.get(photo_url)
-                if img_response.status_code == 200:
-                    image = Image.open(BytesIO(img_response.content))
-                    image_path = f"temp_{index}.jpg"
-                    image.save(image_path)
-                    self.image(image_path, w=60)
+                img_bytes = fotos.get(photo_url)
+                if img_bytes:
+                    # Directamente desde memoria, sin fichero temporal
+                    self.image(BytesIO(img_bytes), w=60)
             except Exception:
                 self.set_font("Arial", "I", 10)
                 self.cell(0, 8, "Error al cargar imagen", ln=True)
@@ -155,20 +114,18 @@ class PDF(FPDF):
 
         self.ln(10)
 
+# Todas las fotos a la vez antes de maquetar, a la resolución justa para 60 mm de ancho
+fotos = precargar((row["Photo URL"] for row in filtered_rows),
+                  caja=(60, None), perfil=parametro("perfil_fotos", "pantalla"))
+
 # Crear y exportar PDF
 pdf = PDF(total_species, max_observaciones)
 pdf.set_auto_page_break(auto=True, margin=15)
 pdf.add_page()
 
-for idx, row in enumerate(filtered_rows):
-    pdf.add_species(row["Common Name"], row["Scientific Name"], row["Observations"], row["Photo URL"], idx)
+for row in filtered_rows:
+    pdf.add_species(row["Common Name"], row["Scientific Name"], row["Observations"], row["Photo URL"])
 
-output_path = "C:/Users/jaime/Desktop/Aprendiendo Python/especies_raras_observadas.pdf"
+output_path = parametro("salida", "C:/Users/jaime/Desktop/Aprendiendo Python/especies_raras_observadas.pdf")
 pdf.output(output_path)
-print(f"PDF exportado con {total_species} especies raras observadas por {username}.")
-
-# Borrar imágenes temporales
-for idx in range(total_species):
-    temp_file = f"temp_{idx}.jpg"
-    if os.path.exists(temp_file):
-        os.remove(temp_file)
\ No newline at end of file
+print(f"PDF exportado con {total_species} especies raras observadas por {username}.")
\ No newline at end of file
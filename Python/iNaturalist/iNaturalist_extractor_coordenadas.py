@@ -1,75 +1,165 @@
-import requests
+import csv
+import os
+
 import pandas as pd
-import time
+
+from iNaturalist_api import DescargaIncompleta
+from iNaturalist_observaciones import paginas_columnas
+from iNaturalist_parametros import parametro
 
 # ---------------------------
 # 🔧 CONFIGURACIÓN DEL USUARIO
 # ---------------------------
 
-TAXON_ID = 85027          # Ej: 47224 = Aves (Birds)
-PLACE_ID = 10543          # Ej: 97394 = España
-MAX_OBS = 1000            # Número máximo de observaciones a obtener (iNaturalist limita a 200 por página)
+TAXON_ID = parametro("taxon_id", 85027)   # Ej: 47224 = Aves (Birds)
+PLACE_ID = parametro("place_id", 10543)   # Ej: 97394 = España
+MAX_OBS = parametro("max_obs", 1000)      # Número máximo de observaciones a obtener (None = todas; iNaturalist limita a 200 por página)
+FORMATO = parametro("formato", "csv")     # "csv" = un único CSV; "parquet" = carpeta con un .parquet por página (requiere pyarrow)
+SALIDA = parametro("salida", r"C:\Users\jaime\Desktop\Aprendiendo Python\inaturalist_observations.csv")
+
+# Columnas del CSV -> ruta en el JSON de la observación (sólo se piden estos campos a la API)
+COLUMNAS = {
+    "id": ("id",),
+    "species": ("species_guess",),
+    "observed_on": ("observed_on",),
+    "latitude": ("geojson", "coordinates", 1),
+    "longitude": ("geojson", "coordinates", 0),
+    "place_guess": ("place_guess",),
+    "user_login": ("user", "login"),
+    "url": ("uri",),
+}
 
 # ---------------------------
-# 🚀 FUNCIÓN PARA DESCARGAR OBSERVACIONES
+# 💾 EXPORTAR A CSV / PARQUET (por páginas, reanudable)
 # ---------------------------
-
-def get_observations(taxon_id, place_id, max_obs=1000):
-    observations = []
+# Cursor por id, sólo los campos de COLUMNAS y geo=true (sólo observaciones con
+# coordenadas). Cada página se escribe en disco nada más llegar, así que la
+# memoria no crece con MAX_OBS. El cursor id_above se guarda en <salida>.cursor.json: si la
+# exportación se corta, al relanzarla se sigue añadiendo desde donde iba. Como
+# las páginas llegan ordenadas por id, las filas con id <= último id ya escrito
+# se descartan (la página en curso al cortarse puede volver a descargarse).
+
+def _ruta_parquet(filename):
+    return os.path.splitext(filename)[0] + "_parquet"
+
+
+def _escritas_csv(filename):
+    # (filas escritas, último id) leyendo el CSV existente con el módulo csv (un
+    # place_guess puede tener saltos de línea). Si la ejecución anterior se cortó a
+    # mitad de una fila, el fichero se recorta hasta el último registro completo.
+    if not os.path.exists(filename):
+        return 0, None
+    leido = 0
+    ultima_linea = b""
+    fin = 0  # bytes hasta el final del último registro completo
+    filas, ultima = -1, None
+
+    with open(filename, "rb") as f:
+        def lineas():
+            nonlocal leido, ultima_linea
+            for linea in f:
+                leido += len(linea)
+                ultima_linea = linea
+                yield linea.decode("utf-8", errors="replace")
+
+        try:
+            for registro in csv.reader(lineas()):
+                if not ultima_linea.endswith(b"\n") or len(registro) != len(COLUMNAS):
+                    break
+                fin = leido
+                filas += 1
+                ultima = registro
+        except csv.Error:
+            pass
+
+    if os.path.getsize(filename) > fin:
+        print(f"⚠️ Última fila de {filename} incompleta: se descarta y se vuelve a escribir.")
+        with open(filename, "r+b") as f:
+            f.truncate(fin)
+    if filas <= 0:
+        return 0, None
+    return filas, int(ultima[0])
+
+
+def _escritas_parquet(carpeta):
+    # Las partes se llaman part-<último id>.parquet: el mayor es el punto de reanudación
+    import pyarrow.parquet as pq
+
+    if not os.path.isdir(carpeta):
+        return 0, None
+    partes = sorted(f for f in os.listdir(carpeta) if f.startswith("part-") and f.endswith(".parquet"))
+    if not partes:
+        return 0, None
+    filas = sum(pq.read_metadata(os.path.join(carpeta, f)).num_rows for f in partes)
+    return filas, int(partes[-1][len("part-"):-len(".parquet")])
+
+
+def _limpiar_salida(filename, formato):
+    if formato == "parquet":
+        carpeta = _ruta_parquet(filename)
+        if os.path.isdir(carpeta):
+            for f in os.listdir(carpeta):
+                if f.startswith("part-"):
+                    os.remove(os.path.join(carpeta, f))
+    elif os.path.exists(filename):
+        os.remove(filename)
+
+
+def exportar_observaciones(taxon_id, place_id, filename, max_obs=None, formato="csv"):
     per_page = 200
-    page = 1
-
-    while len(observations) < max_obs:
-        url = "https://api.inaturalist.org/v1/observations"
-        params = {
-            "taxon_id": taxon_id,
-            "place_id": place_id,
-            "verifiable": "true",
-            "per_page": per_page,
-            "page": page,
-            "order_by": "observed_on",
-            "geo": True,  # solo observaciones con coordenadas
-        }
-
-        response = requests.get(url, params=params)
-        if response.status_code != 200:
-            print(f"Error en la solicitud: {response.status_code}")
-            break
-
-        results = response.json().get("results", [])
-        if not results:
-            break
-
-        for obs in results:
-            observations.append({
-                "id": obs.get("id"),
-                "species": obs.get("species_guess"),
-                "observed_on": obs.get("observed_on"),
-                "latitude": obs.get("geojson", {}).get("coordinates", [None, None])[1],
-                "longitude": obs.get("geojson", {}).get("coordinates", [None, None])[0],
-                "place_guess": obs.get("place_guess"),
-                "user_login": obs.get("user", {}).get("login"),
-                "url": obs.get("uri")
-            })
-
-        print(f"Página {page} descargada, total observaciones: {len(observations)}")
-        page += 1
-        time.sleep(1)  # evita hacer demasiadas peticiones muy rápido
-
-        if len(results) < per_page:
-            break
-
-    return observations[:max_obs]
-
-# ---------------------------
-# 💾 EXPORTAR A CSV
-# ---------------------------
-
-def save_to_csv(observations, filename=r"C:\Users\jaime\Desktop\Aprendiendo Python\inaturalist_observations.csv"):
-    df = pd.DataFrame(observations)
-    df = df.dropna(subset=["latitude", "longitude"])
-    df.to_csv(filename, index=False)
-    print(f"Archivo guardado: {filename}")
+    params = {
+        "taxon_id": taxon_id,
+        "place_id": place_id,
+        "verifiable": "true",
+    }
+    checkpoint = filename + ".cursor.json"
+
+    # Sin checkpoint se empieza de cero; con checkpoint se continúa el fichero existente
+    if not os.path.exists(checkpoint):
+        _limpiar_salida(filename, formato)
+    if formato == "parquet":
+        carpeta = _ruta_parquet(filename)
+        os.makedirs(carpeta, exist_ok=True)
+        total, ultimo_id = _escritas_parquet(carpeta)
+    else:
+        total, ultimo_id = _escritas_csv(filename)
+    if total:
+        print(f"Reanudando exportación: {total} observaciones ya escritas (último id {ultimo_id})")
+
+    try:
+        for n, pagina in enumerate(paginas_columnas(params, COLUMNAS, per_page=per_page, checkpoint=checkpoint), start=1):
+            df = pd.DataFrame(pagina)
+            if ultimo_id is not None:
+                df = df[df["id"] > ultimo_id]
+            df = df.dropna(subset=["latitude", "longitude"])
+            if max_obs is not None:
+                df = df.iloc[:max(max_obs - total, 0)]
+
+            if len(df):
+                if formato == "parquet":
+                    destino = os.path.join(carpeta, f"part-{int(df['id'].iloc[-1]):012d}.parquet")
+                    df.to_parquet(destino + ".tmp", index=False, engine="pyarrow")
+                    os.replace(destino + ".tmp", destino)
+                else:
+                    df.to_csv(filename, mode="a", header=total == 0, index=False)
+                total += len(df)
+                ultimo_id = int(df["id"].iloc[-1])
+            print(f"Página {n} escrita, total observaciones: {total}")
+
+            if max_obs is not None and total >= max_obs:
+                break
+    except DescargaIncompleta as e:
+        # Falló una página: el checkpoint se queda para seguir desde la última escrita
+        print(f"⚠️ {e}")
+
+    # Terminado (o alcanzado MAX_OBS): la próxima ejecución empieza de cero
+    if max_obs is not None and total >= max_obs and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    if os.path.exists(checkpoint):
+        print(f"⚠️ Exportación incompleta ({total} observaciones); vuelve a ejecutar para continuar.")
+    else:
+        print(f"Archivo guardado: {_ruta_parquet(filename) if formato == 'parquet' else filename}")
+    return total
 
 
 # ---------------------------
@@ -77,5 +167,4 @@ def save_to_csv(observations, filename=r"C:\Users\jaime\Desktop\Aprendiendo Pyth
 # ---------------------------
 
 if __name__ == "__main__":
-    obs = get_observations(TAXON_ID, PLACE_ID, MAX_OBS)
-    save_to_csv(obs)
\ No newline at end of file
+    exportar_observaciones(TAXON_ID, PLACE_ID, SALIDA, MAX_OBS, FORMATO)
\ No newline at end of file
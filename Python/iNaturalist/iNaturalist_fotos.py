@@ -0,0 +1,310 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import iNaturalist_cache as cache
+from iNaturalist_api import RECORD_DIR, get_bytes
+
+# =========================
+# Caché de fotos en disco
+# =========================
+# Las fotos de iNaturalist no cambian: /photos/<id>/<variante>.<ext> (square,
+# small, medium, large, original) siempre devuelve la misma imagen. Se guardan
+# una vez en FOTOS_DIR con el nombre del sha256 de su contenido, y un índice en
+# SQLite relaciona (id de foto, variante) con ese sha256, así que dos claves que
+# apuntan a la misma imagen comparten fichero. Al leer se comprueba que el
+# fichero sigue teniendo ese sha256 (si no, se borra y se descarga de nuevo) y
+# sólo se guardan respuestas que empiezan como una imagen. La carpeta se mantiene
+# por debajo de MAX_BYTES_FOTOS expulsando las fotos usadas hace más tiempo.
+#
+# --refresh no afecta a las fotos; INAT_NO_CACHE=1 (o el modo replay) sí la apaga.
+# Grabando (INAT_RECORD_DIR) no se lee, para que todas las fotos lleguen a la grabación.
+
+FOTOS_DIR = os.environ.get(
+    "INAT_FOTOS_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "fotos")
+)
+MAX_BYTES_FOTOS = 1024 * 1024 * 1024
+
+_URL_FOTO = re.compile(r"/photos/(\d+)/([a-z]+)\.\w+")
+_FIRMAS_IMAGEN = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a", b"RIFF")
+
+_lock = threading.Lock()
+_conn = None
+
+
+def _conexion():
+    global _conn
+    if _conn is None:
+        os.makedirs(FOTOS_DIR, exist_ok=True)
+        _conn = sqlite3.connect(os.path.join(FOTOS_DIR, "indice.sqlite"), check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("""
+            CREATE TABLE IF NOT EXISTS fotos (
+                clave TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                tamano INTEGER NOT NULL,
+                accedido REAL NOT NULL
+            )
+        """)
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_fotos_accedido ON fotos (accedido)")
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_fotos_sha256 ON fotos (sha256)")
+        _conn.commit()
+    return _conn
+
+
+def clave_foto(url):
+    # "12345/medium" para las URLs de fotos de iNaturalist; el hash de la URL para el resto
+    m = _URL_FOTO.search(url)
+    if m:
+        return f"{m.group(1)}/{m.group(2)}"
+    return "url/" + hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+def _ruta_blob(sha256):
+    return os.path.join(FOTOS_DIR, sha256[:2], sha256)
+
+
+def es_imagen(datos):
+    return bool(datos) and datos.startswith(_FIRMAS_IMAGEN)
+
+
+def leer(url):
+    k = clave_foto(url)
+    with _lock:
+        fila = _conexion().execute("SELECT sha256 FROM fotos WHERE clave = ?", (k,)).fetchone()
+    if fila is None:
+        return None
+    try:
+        with open(_ruta_blob(fila[0]), "rb") as f:
+            datos = f.read()
+    except OSError:
+        datos = None
+    with _lock:
+        conn = _conexion()
+        if datos is None or hashlib.sha256(datos).hexdigest() != fila[0]:
+            # Fichero borrado o corrupto: se olvida y se vuelve a descargar
+            conn.execute("DELETE FROM fotos WHERE sha256 = ?", (fila[0],))
+            conn.commit()
+            if datos is not None:
+                os.remove(_ruta_blob(fila[0]))
+            return None
+        conn.execute("UPDATE fotos SET accedido = ? WHERE clave = ?", (time.time(), k))
+        conn.commit()
+    return datos
+
+
+def guardar(url, datos):
+    sha256 = hashlib.sha256(datos).hexdigest()
+    ruta = _ruta_blob(sha256)
+    if not os.path.exists(ruta):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(datos)
+        os.replace(tmp, ruta)
+    with _lock:
+        conn = _conexion()
+        conn.execute("INSERT OR REPLACE INTO fotos (clave, sha256, tamano, accedido) VALUES (?, ?, ?, ?)",
+                     (clave_foto(url), sha256, len(datos), time.time()))
+        _expulsar(conn)
+        conn.commit()
+
+
+def _expulsar(conn):
+    # Tamaño real en disco: cada sha256 cuenta una sola vez
+    total = conn.execute(
+        "SELECT COALESCE(SUM(tamano), 0) FROM (SELECT MAX(tamano) AS tamano FROM fotos GROUP BY sha256)"
+    ).fetchone()[0]
+    if total <= MAX_BYTES_FOTOS:
+        return
+    objetivo = total - int(MAX_BYTES_FOTOS * 0.9)
+    liberado = 0
+    filas = conn.execute(
+        "SELECT sha256, MAX(tamano), MAX(accedido) AS ultimo FROM fotos GROUP BY sha256 ORDER BY ultimo ASC"
+    ).fetchall()
+    for sha256, tamano, _ in filas:
+        conn.execute("DELETE FROM fotos WHERE sha256 = ?", (sha256,))
+        try:
+            os.remove(_ruta_blob(sha256))
+        except OSError:
+            pass
+        liberado += tamano
+        if liberado >= objetivo:
+            break
+
+
+def foto(url, timeout=10):
+    # Bytes de la foto: de la caché si está y es íntegra; si no, se descarga y se guarda
+    if not url:
+        return None
+    if not cache.DESACTIVADA and not RECORD_DIR:
+        datos = leer(url)
+        if datos is not None:
+            return datos
+    datos = get_bytes(url, timeout=timeout)
+    if not es_imagen(datos):
+        return None
+    if not cache.DESACTIVADA:
+        guardar(url, datos)
+    return datos
+
+
+# =========================
+# JPEG sin recodificar
+# =========================
+# Un PDF puede llevar un JPEG tal cual (filtro DCTDecode) y reportlab copia esos
+# bytes sin descomprimirlos. Para saber si se puede basta con la cabecera: JPEG
+# secuencial (SOF0/SOF1) en gris o YCbCr. Los progresivos, los CMYK (Photoshop
+# los guarda invertidos) y los PNG/GIF/WebP sí se pasan por PIL.
+
+_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_SOF_SECUENCIAL = {0xC0, 0xC1}
+
+
+def cabecera_jpeg(datos):
+    # (ancho, alto, componentes, marcador SOF) sin decodificar la imagen; None si no es JPEG
+    if not datos or not datos.startswith(b"\xff\xd8"):
+        return None
+    i = 2
+    while i + 4 <= len(datos):
+        if datos[i] != 0xFF:
+            return None
+        marcador = datos[i + 1]
+        if marcador == 0xFF:
+            i += 1
+            continue
+        if marcador == 0x01 or 0xD0 <= marcador <= 0xD7:
+            i += 2
+            continue
+        if marcador in (0xD9, 0xDA):
+            return None
+        if marcador in _SOF:
+            if i + 10 > len(datos):
+                return None
+            alto = int.from_bytes(datos[i + 5:i + 7], "big")
+            ancho = int.from_bytes(datos[i + 7:i + 9], "big")
+            return ancho, alto, datos[i + 9], marcador
+        i += 2 + int.from_bytes(datos[i + 2:i + 4], "big")
+    return None
+
+
+def jpeg_directo(datos):
+    # (ancho, alto) si los bytes pueden ir al PDF sin recodificar; None si hay que pasar por PIL
+    cabecera = cabecera_jpeg(datos)
+    if cabecera is None:
+        return None
+    ancho, alto, componentes, marcador = cabecera
+    if marcador not in _SOF_SECUENCIAL or componentes not in (1, 3) or not ancho or not alto:
+        return None
+    return ancho, alto
+
+
+# =========================
+# Resolución según el tamaño en el PDF
+# =========================
+# Cada foto se pide en la variante más pequeña cuyo lado mayor llega a los puntos
+# por pulgada del perfil para la caja en la que se va a mostrar (ancho, alto en
+# mm; alto None = sin límite). Si aun así sobran píxeles se reduce con Lanczos y
+# se guarda como JPEG con la calidad del perfil. En la caché queda la descarga
+# sin tocar, así que cambiar de perfil no obliga a descargar de nuevo.
+
+VARIANTES = [("small", 240), ("medium", 500), ("large", 1024), ("original", 2048)]
+
+# Sin conocer aún la proporción de la foto se cuenta con que ocupe todo el lado
+# mayor de la caja, pero sólo las muy apaisadas lo hacen (una 3:2 en la caja de
+# la guía, 180 x 115,7 mm, mide 174 mm de ancho). Se acepta una variante a la que
+# le falte hasta un 5 % (p. ej. 143 en lugar de 150 ppp, inapreciable) antes de
+# saltar a la siguiente, que pesa unas cuatro veces más.
+TOLERANCIA_VARIANTE = 0.95
+
+PERFILES = {
+    "borrador": {"dpi": 72, "calidad": 60},
+    "pantalla": {"dpi": 150, "calidad": 80},
+    "impresion": {"dpi": 300, "calidad": 90},
+}
+
+
+def _pixeles(mm, dpi):
+    return max(1, int(round(mm / 25.4 * dpi)))
+
+
+def variante_foto(url, caja, perfil="pantalla"):
+    # URL de la variante justa para la caja; las que no son de iNaturalist se quedan igual
+    m = _URL_FOTO.search(url or "")
+    if not m:
+        return url
+    necesario = _pixeles(max(l for l in caja if l), PERFILES[perfil]["dpi"])
+    nombre = next((n for n, lado in VARIANTES if lado >= necesario * TOLERANCIA_VARIANTE), VARIANTES[-1][0])
+    return url[:m.start(2)] + nombre + url[m.end(2):]
+
+
+def reducir(datos, caja, perfil="pantalla"):
+    # Bytes de la foto con, como mucho, los píxeles que pide la caja al dpi del perfil.
+    # Con JPEG el tamaño sale de la cabecera y PIL sólo se carga si hay que reducir.
+    cabecera = cabecera_jpeg(datos)
+    imagen = None
+    if cabecera and cabecera[0] and cabecera[1]:
+        ancho, alto = cabecera[:2]
+    else:
+        from PIL import Image
+        imagen = Image.open(BytesIO(datos))
+        ancho, alto = imagen.size
+    dpi = PERFILES[perfil]["dpi"]
+    escala = min(l / p for l, p in zip(caja, (ancho, alto)) if l)  # mm por píxel al encajarla
+    objetivo = (_pixeles(ancho * escala, dpi), _pixeles(alto * escala, dpi))
+    if objetivo[0] * 1.2 >= ancho:
+        # Sobra poco o nada: no merece la pena recodificar
+        return datos
+    from PIL import Image
+    if imagen is None:
+        imagen = Image.open(BytesIO(datos))
+    # Con JPEG, draft() deja que el propio decodificador la reduzca 1/2, 1/4 u 1/8
+    imagen.draft("RGB", objetivo)
+    imagen = imagen.convert("RGB").resize(objetivo, Image.LANCZOS)
+    salida = BytesIO()
+    imagen.save(salida, format="JPEG", quality=PERFILES[perfil]["calidad"], optimize=True)
+    return salida.getvalue()
+
+
+# =========================
+# Precarga en paralelo
+# =========================
+def precargar(urls, hilos=8, timeout=10, caja=None, perfil="pantalla"):
+    # Descarga a la vez todas las fotos de un informe antes de maquetar (las que ya
+    # están en caché no esperan) y devuelve {url: bytes, o None si falló}. Los
+    # fallos se avisan aquí, antes de empezar el PDF. Con caja, cada foto se pide
+    # en la variante del perfil y se reduce, pero se sigue devolviendo por su URL.
+    urls = list(dict.fromkeys(u for u in urls if u))
+    if not urls:
+        return {}
+
+    def una(url):
+        if caja is None:
+            return foto(url, timeout)
+        variante = variante_foto(url, caja, perfil)
+        datos = foto(variante, timeout)
+        if datos is None and variante != url:
+            datos = foto(url, timeout)
+        if datos is None:
+            return None
+        try:
+            return reducir(datos, caja, perfil)
+        except Exception:
+            # Si PIL no puede con ella se usa tal cual
+            return datos
+
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        datos = dict(zip(urls, pool.map(una, urls)))
+    fallidas = [url for url, d in datos.items() if d is None]
+    print(f"Fotos listas: {len(urls) - len(fallidas)} de {len(urls)}")
+    if fallidas:
+        print(f"⚠️ No se pudieron descargar {len(fallidas)} fotos:")
+        for url in fallidas:
+            print(f"   - {url}")
+    return datos
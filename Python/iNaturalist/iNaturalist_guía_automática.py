@@ -1,31 +1,28 @@
-import requests
 import pandas as pd
-import geopandas as gpd
-import matplotlib.pyplot as plt
-from shapely.geometry import Point
 from io import BytesIO
+import json
 import os
-import time
+import shutil
 
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Image, Spacer, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import cm
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from PIL import Image as PILImage
-from PyPDF2 import PdfMerger
+import numpy as np
+
+from iNaturalist_api import DescargaIncompleta, paginar_concurrente
+from iNaturalist_fotos import cabecera_jpeg, jpeg_directo, precargar
+from iNaturalist_observaciones import concatenar, paginas_columnas
+from iNaturalist_parametros import parametro
+from iNaturalist_taxones import nombres, resolver_taxones
+from iNaturalist_usuario import ids_observados, no_observadas
 
 # =========================
 # Parámetros
 # =========================
-PLACE_ID = 10543
-ROOT_TAXON_ID = 3  # Aves
-MIN_OBS = 100
-EXCLUDE_USER = "JaigoL"
+PLACE_ID = parametro("place_id", 10543)
+ROOT_TAXON_ID = parametro("taxon_id", 3)  # Aves
+MIN_OBS = parametro("min_observations", 100)
+EXCLUDE_USER = parametro("username", "JaigoL")
 
-SHAPEFILE = "C:/Users/jaime/Desktop/Guía de plantas y animales no avistados/Shapefile Comunidad de Madrid/municipios_madrid.shp"
-OUTPUT_PDF = "C:/Users/jaime/Desktop/Guía de plantas y animales no avistados/Guía de aves no avistadas de la Comunidad de Madrid.pdf"
+SHAPEFILE = parametro("shapefile", "C:/Users/jaime/Desktop/Guía de plantas y animales no avistados/Shapefile Comunidad de Madrid/municipios_madrid.shp")
+OUTPUT_PDF = parametro("salida", "C:/Users/jaime/Desktop/Guía de plantas y animales no avistados/Guía de aves no avistadas de la Comunidad de Madrid.pdf")
 
 FUENTE_NORMAL = "C:/Users/jaime/Desktop/Guía de plantas y animales no avistados/Fuentes/times.ttf"
 FUENTE_ITALIC = "C:/Users/jaime/Desktop/Guía de plantas y animales no avistados/Fuentes/timesi.ttf"
@@ -33,68 +30,55 @@ FUENTE_ITALIC = "C:/Users/jaime/Desktop/Guía de plantas y animales no avistados
 PORTADA_PDF = "C:/Users/jaime/Desktop/Guía de plantas y animales no avistados/Portada de guía de aves no avistadas.pdf"
 CONTRAPORTADA_PDF = "C:/Users/jaime/Desktop/Guía de plantas y animales no avistados/Contraportada de guía de aves no avistadas.pdf"
 
-# =========================
-# Función para requests con manejo de 429
-# =========================
-def get_json(url, params=None):
-    while True:
-        try:
-            r = requests.get(url, params=params, timeout=10)
-            if r.status_code == 429:
-                print("⚠️ Demasiadas solicitudes. Esperando 10 seg...")
-                time.sleep(10)
-                continue
-            r.raise_for_status()
-            return r.json()
-        except requests.RequestException as e:
-            print(f"⚠️ Error en request {url}: {e}. Reintentando en 10 seg...")
-            time.sleep(10)
+# Resolución de las fotos: "borrador", "pantalla" o "impresion" (ver iNaturalist_fotos)
+PERFIL_FOTOS = parametro("perfil_fotos", "pantalla")
+CAJA_FOTO = (180, 115.7)  # mm: hueco máximo de la foto en la página
+
+# Carpeta de trabajo: un subdirectorio por especie con lo ya descargado y
+# renderizado, y un manifest.json con las especies terminadas. Si la ejecución
+# se corta, al relanzarla sólo se procesan las especies nuevas o que cambiaron.
+WORK_DIR = os.path.splitext(OUTPUT_PDF)[0] + " (trabajo)"
 
 # =========================
 # Buscar especies candidatas
 # =========================
 print("Buscando especies candidatas...")
 species = []
-page = 1
-while True:
-    params = {
-        "place_id": PLACE_ID,
-        "taxon_id": ROOT_TAXON_ID,
-        "quality_grade": "research",
-        "per_page": 200,
-        "page": page
-    }
-    data = get_json("https://api.inaturalist.org/v1/observations/species_counts", params)
-    results = data.get("results", [])
-    if not results:
-        break
-    for s in results:
-        if s["count"] >= MIN_OBS:
-            species.append({"taxon_id": s["taxon"]["id"], "name": s["taxon"]["name"]})
-    page += 1
-    time.sleep(1)
+params = {
+    "place_id": PLACE_ID,
+    "taxon_id": ROOT_TAXON_ID,
+    "quality_grade": "research"
+}
+for s in paginar_concurrente("observations/species_counts", params, per_page=200):
+    if s["count"] >= MIN_OBS:
+        species.append({"taxon_id": s["taxon"]["id"], "name": s["taxon"]["name"], "count": s["count"]})
 
 # =========================
 # Filtrar especies vistas por el usuario
 # =========================
 print("Filtrando especies no observadas por el usuario...")
-species_final = []
-for sp in species:
-    params = {"taxon_id": sp["taxon_id"], "user_login": EXCLUDE_USER, "per_page": 1}
-    try:
-        data = get_json("https://api.inaturalist.org/v1/observations", params)
-        if data.get("total_results", 0) == 0:
-            species_final.append(sp)
-    except Exception:
-        print(f"⚠️ No se pudo consultar taxon_id {sp['taxon_id']}, se asume no observado.")
-        species_final.append(sp)
+# Una sola descarga de la lista de vida (todas sus observaciones, no sólo las verificables)
+observadas = ids_observados(EXCLUDE_USER, [ROOT_TAXON_ID], verifiable=False)
+species_final = no_observadas(species, observadas, campo="taxon_id")
 
 species_final = sorted(species_final, key=lambda x: x["name"])
 print(f"Especies finales en la guía: {len(species_final)}")
 
+# =========================
+# Info de taxones (por lotes, con nombre común en español)
+# =========================
+taxones = resolver_taxones([sp["taxon_id"] for sp in species_final], locale="es")
+
 # =========================
 # Preparar PDF en memoria
 # =========================
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Image, Spacer, PageBreak
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm, mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
 pdf_buffer = BytesIO()
 pdfmetrics.registerFont(TTFont("TimesNewRoman", FUENTE_NORMAL))
 pdfmetrics.registerFont(TTFont("TimesNewRomanItalic", FUENTE_ITALIC))
@@ -112,123 +96,245 @@ styles = getSampleStyleSheet()
 styles.add(ParagraphStyle(name="NombreComun", fontName="TimesNewRoman", fontSize=33, spaceAfter=24))
 styles.add(ParagraphStyle(name="NombreCientifico", fontName="TimesNewRomanItalic", fontSize=24, spaceAfter=40))
 
-story = []
-municipios = gpd.read_file(SHAPEFILE).to_crs("EPSG:4326")
-
 # =========================
-# Procesar cada especie
+# Carpeta de trabajo y manifest
 # =========================
-for sp in species_final:
-    TAXON_ID = sp["taxon_id"]
-    print(f"Procesando {sp['name']}")
+MANIFEST = os.path.join(WORK_DIR, "manifest.json")
+os.makedirs(WORK_DIR, exist_ok=True)
 
-    # Info taxón
-    taxon_data_json = get_json(f"https://api.inaturalist.org/v1/taxa/{TAXON_ID}")
-    taxon_es_json = get_json(f"https://api.inaturalist.org/v1/taxa/{TAXON_ID}?locale=es")
-    if not taxon_data_json or not taxon_es_json:
-        print(f"❌ No se pudo obtener info para taxon_id {TAXON_ID}, se salta.")
-        continue
 
-    taxon_data = taxon_data_json["results"][0]
-    taxon_es = taxon_es_json["results"][0]
+def leer_manifest():
+    if not os.path.exists(MANIFEST):
+        return {}
+    try:
+        with open(MANIFEST, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-    nombre_cientifico = taxon_data["name"]
-    nombre_comun = taxon_es.get("preferred_common_name", nombre_cientifico).capitalize()
 
-    # Foto
-    photo_img = None
-    if taxon_data.get("default_photo"):
-        photo_url = taxon_data["default_photo"].get("original_url") \
-                    or taxon_data["default_photo"].get("large_url") \
-                    or taxon_data["default_photo"].get("medium_url") \
-                    or taxon_data["default_photo"]["url"]
+def guardar_manifest(manifest):
+    tmp = MANIFEST + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, MANIFEST)
+
+
+def url_foto(taxon_data):
+    foto = taxon_data.get("default_photo")
+    if not foto:
+        return None
+    return foto.get("original_url") or foto.get("large_url") or foto.get("medium_url") or foto["url"]
+
+
+def firma_especie(sp, taxon_data):
+    # Si cambia cualquiera de estos datos la especie se vuelve a procesar desde cero
+    return {
+        "count": sp["count"],
+        "photo_url": url_foto(taxon_data),
+        "place_id": PLACE_ID,
+        "shapefile": SHAPEFILE,
+        "perfil_fotos": PERFIL_FOTOS,
+    }
+
+
+manifest = leer_manifest()
+municipios = None
+
+# =========================
+# Procesar cada especie
+# =========================
+def clasificar(n):
+    if 1 <= n <= 3: return "Raro"
+    elif 4 <= n <= 25: return "Común"
+    elif n > 25: return "Muy común"
+    else: return None
+
+
+def procesar_especie(sp, taxon_data, carpeta):
+    # Cada paso deja su fichero en la carpeta de la especie; si ya existe se reutiliza.
+    # geopandas y matplotlib sólo se cargan si hay algo que procesar, y PIL sólo
+    # si alguna foto hay que recodificarla.
+    global municipios
+    import geopandas as gpd
+    import matplotlib.pyplot as plt
+    from shapely.geometry import Point
 
+    TAXON_ID = sp["taxon_id"]
+    os.makedirs(carpeta, exist_ok=True)
+
+    with open(os.path.join(carpeta, "taxon.json"), "w", encoding="utf-8") as f:
+        json.dump(taxon_data, f, ensure_ascii=False)
+
+    nombre_cientifico, nombre_comun = nombres(taxon_data)
+    entrada = {
+        "nombre_comun": nombre_comun.capitalize(),
+        "nombre_cientifico": nombre_cientifico,
+        "foto": None,
+        "vacia": False,
+        "completa": True,
+    }
+
+    # Foto
+    ruta_foto = os.path.join(carpeta, "foto.jpg")
+    if not os.path.exists(ruta_foto) and url_foto(taxon_data):
         try:
-            resp = requests.get(photo_url)
-            if resp.status_code == 200:
-                photo_img = PILImage.open(BytesIO(resp.content)).convert("RGB")
+            # Precargada antes del bucle; se suelta de memoria al usarla
+            photo_bytes = fotos.pop(url_foto(taxon_data), None)
+            if photo_bytes and jpeg_directo(photo_bytes):
+                # JPEG secuencial RGB/gris: se guarda tal cual y reportlab lo incrusta sin descomprimir
+                with open(ruta_foto, "wb") as f:
+                    f.write(photo_bytes)
+            elif photo_bytes:
+                # CMYK, progresivo, PNG...: se recodifica a JPEG RGB
+                from PIL import Image as PILImage
+                PILImage.open(BytesIO(photo_bytes)).convert("RGB").save(ruta_foto, format="JPEG")
         except:
-            photo_img = None
+            pass
+    if os.path.exists(ruta_foto):
+        # Tamaño leído de la cabecera, sin decodificar la foto
+        with open(ruta_foto, "rb") as f:
+            cabecera = cabecera_jpeg(f.read())
+        if cabecera:
+            entrada["foto"] = list(cabecera[:2])
+    elif url_foto(taxon_data):
+        # Falló la descarga: la especie entra sin foto y se reintenta en la próxima ejecución
+        entrada["completa"] = False
 
     # =========================
     # Observaciones
     # =========================
-    records = []
-    page_obs = 1
-    while True:
-        params = {"taxon_id": TAXON_ID, "place_id": PLACE_ID, "quality_grade": "research", "per_page": 200, "page": page_obs}
-        data_obs = get_json("https://api.inaturalist.org/v1/observations", params)
-        results_obs = data_obs.get("results", [])
-        if not results_obs:
-            break
-        for obs in results_obs:
-            if obs.get("geojson"):
-                lon, lat = obs["geojson"]["coordinates"]
-                records.append({"lon": lon, "lat": lat, "observed_on": obs["observed_on"]})
-        if len(results_obs) < 200:
-            break
-        page_obs += 1
-        time.sleep(1)
-
-    if not records:
-        continue
-
-    df_obs = pd.DataFrame(records)
-    gdf_obs = gpd.GeoDataFrame(df_obs, geometry=[Point(xy) for xy in zip(df_obs.lon, df_obs.lat)], crs="EPSG:4326")
-    join = gpd.sjoin(gdf_obs, municipios, how="left", predicate="within")
-    counts = join.groupby("NAMEUNIT").size().reset_index(name="n_obs")
-    muni_copy = municipios.merge(counts, on="NAMEUNIT", how="left").fillna(0)
-
-    def clasificar(n):
-        if 1 <= n <= 3: return "Raro"
-        elif 4 <= n <= 25: return "Común"
-        elif n > 25: return "Muy común"
-        else: return None
-
-    muni_copy["categoria"] = muni_copy["n_obs"].apply(clasificar)
-    muni_copy["categoria"] = pd.Categorical(muni_copy["categoria"], categories=["Raro","Común","Muy común"], ordered=True)
-    contorno = muni_copy.dissolve()
+    # Sólo id, coordenadas y fecha (fields + geo=true), decodificado en columnas
+    ruta_obs = os.path.join(carpeta, "observaciones.npz")
+    if os.path.exists(ruta_obs):
+        with np.load(ruta_obs) as datos:
+            columnas = {k: datos[k] for k in datos.files}
+    else:
+        params = {"taxon_id": TAXON_ID, "place_id": PLACE_ID, "quality_grade": "research"}
+        try:
+            columnas = concatenar(paginas_columnas(params))
+        except DescargaIncompleta as e:
+            # Con las observaciones a medias el mapa y la fenología serían falsos: no se
+            # guarda nada y la especie queda pendiente
+            print(f"⚠️ Observaciones incompletas ({e}); se reintentará en la próxima ejecución.")
+            return None
+        columnas["observed_on"] = np.array([v or "" for v in columnas["observed_on"]], dtype=str)
+        np.savez(ruta_obs, **columnas)
+    df_obs = pd.DataFrame(columnas).dropna(subset=["lon", "lat"])
+
+    if df_obs.empty:
+        entrada["vacia"] = True
+        return entrada
 
     # =========================
-    # Generar mapa en memoria
+    # Generar mapa
     # =========================
-    fig, ax = plt.subplots(figsize=(8,10))
-    muni_copy.plot(column="categoria", cmap="Reds", linewidth=0.2, edgecolor="grey", legend=True,
-                   legend_kwds={"title":"Frecuencia","loc":"lower left"}, ax=ax,
-                   missing_kwds={"color":"white","edgecolor":"lightgrey","label":"Ausente"})
-    contorno.boundary.plot(ax=ax, linewidth=1.8, edgecolor="black")
-    ax.set_axis_off()
-    buf_map = BytesIO()
-    plt.tight_layout()
-    plt.savefig(buf_map, dpi=300)
-    plt.close()
-    buf_map.seek(0)
+    ruta_mapa = os.path.join(carpeta, "mapa.png")
+    if not os.path.exists(ruta_mapa):
+        if municipios is None:
+            municipios = gpd.read_file(SHAPEFILE).to_crs("EPSG:4326")
+        gdf_obs = gpd.GeoDataFrame(df_obs, geometry=[Point(xy) for xy in zip(df_obs.lon, df_obs.lat)], crs="EPSG:4326")
+        join = gpd.sjoin(gdf_obs, municipios, how="left", predicate="within")
+        counts = join.groupby("NAMEUNIT").size().reset_index(name="n_obs")
+        muni_copy = municipios.merge(counts, on="NAMEUNIT", how="left").fillna(0)
+
+        muni_copy["categoria"] = muni_copy["n_obs"].apply(clasificar)
+        muni_copy["categoria"] = pd.Categorical(muni_copy["categoria"], categories=["Raro","Común","Muy común"], ordered=True)
+        contorno = muni_copy.dissolve()
+
+        fig, ax = plt.subplots(figsize=(8,10))
+        muni_copy.plot(column="categoria", cmap="Reds", linewidth=0.2, edgecolor="grey", legend=True,
+                       legend_kwds={"title":"Frecuencia","loc":"lower left"}, ax=ax,
+                       missing_kwds={"color":"white","edgecolor":"lightgrey","label":"Ausente"})
+        contorno.boundary.plot(ax=ax, linewidth=1.8, edgecolor="black")
+        ax.set_axis_off()
+        plt.tight_layout()
+        plt.savefig(ruta_mapa + ".tmp.png", dpi=300)
+        plt.close()
+        os.replace(ruta_mapa + ".tmp.png", ruta_mapa)
 
     # =========================
     # Fenología (gráfico temporal)
     # =========================
-    df_obs["observed_on"] = pd.to_datetime(df_obs["observed_on"], errors="coerce")
-    df_obs["mes"] = df_obs["observed_on"].dt.month
-    mensual = df_obs.groupby("mes").size().reindex(range(1,13), fill_value=0)
-    meses = ["ENE","FEB","MAR","ABR","MAY","JUN","JUL","AGO","SEP","OCT","NOV","DIC"]
-
-    fig, ax = plt.subplots(figsize=(9,4))
-    ax.plot(range(1,13), mensual, linewidth=2)
-    ax.fill_between(range(1,13), mensual, alpha=0.4)
-    ax.set_xticks(range(1,13))
-    ax.set_xticklabels(meses)
-    max_y = mensual.max()
-    y_max = int(max_y*1.1)
-    ax.set_ylim(0, y_max)
-    ax.yaxis.grid(True, linestyle=":", linewidth=0.8, alpha=0.6)
-    for spine in ["top","right","left","bottom"]:
-        ax.spines[spine].set_visible(False)
-    ax.tick_params(axis="y", labelsize=9)
-    buf_temp = BytesIO()
-    plt.tight_layout()
-    plt.savefig(buf_temp, dpi=300)
-    plt.close()
-    buf_temp.seek(0)
+    ruta_fenologia = os.path.join(carpeta, "fenologia.png")
+    if not os.path.exists(ruta_fenologia):
+        df_obs["observed_on"] = pd.to_datetime(df_obs["observed_on"], errors="coerce")
+        df_obs["mes"] = df_obs["observed_on"].dt.month
+        mensual = df_obs.groupby("mes").size().reindex(range(1,13), fill_value=0)
+        meses = ["ENE","FEB","MAR","ABR","MAY","JUN","JUL","AGO","SEP","OCT","NOV","DIC"]
+
+        fig, ax = plt.subplots(figsize=(9,4))
+        ax.plot(range(1,13), mensual, linewidth=2)
+        ax.fill_between(range(1,13), mensual, alpha=0.4)
+        ax.set_xticks(range(1,13))
+        ax.set_xticklabels(meses)
+        max_y = mensual.max()
+        y_max = int(max_y*1.1)
+        ax.set_ylim(0, y_max)
+        ax.yaxis.grid(True, linestyle=":", linewidth=0.8, alpha=0.6)
+        for spine in ["top","right","left","bottom"]:
+            ax.spines[spine].set_visible(False)
+        ax.tick_params(axis="y", labelsize=9)
+        plt.tight_layout()
+        plt.savefig(ruta_fenologia + ".tmp.png", dpi=300)
+        plt.close()
+        os.replace(ruta_fenologia + ".tmp.png", ruta_fenologia)
+
+    return entrada
+
+
+por_procesar = []
+for sp in species_final:
+    TAXON_ID = sp["taxon_id"]
+
+    # Info taxón
+    taxon_data = taxones.get(TAXON_ID)
+    if not taxon_data:
+        print(f"❌ No se pudo obtener info para taxon_id {TAXON_ID}, se salta.")
+        continue
+
+    clave = str(TAXON_ID)
+    carpeta = os.path.join(WORK_DIR, clave)
+    firma = firma_especie(sp, taxon_data)
+    anterior = manifest.get(clave)
+    if anterior and anterior.get("firma") == firma and anterior.get("completa", True):
+        continue
+    if anterior and anterior.get("firma") != firma and os.path.isdir(carpeta):
+        # Ha cambiado (más observaciones, otra foto...): se descarta lo anterior
+        shutil.rmtree(carpeta)
+    por_procesar.append((sp, taxon_data, carpeta, firma))
+
+# Fotos de las especies pendientes, todas a la vez antes de procesarlas
+fotos = precargar(
+    (url_foto(taxon_data) for _, taxon_data, carpeta, _ in por_procesar
+     if not os.path.exists(os.path.join(carpeta, "foto.jpg"))),
+    timeout=30, caja=CAJA_FOTO, perfil=PERFIL_FOTOS
+)
+
+for sp, taxon_data, carpeta, firma in por_procesar:
+    print(f"Procesando {sp['name']}")
+    entrada = procesar_especie(sp, taxon_data, carpeta)
+    if entrada is None:
+        continue
+    entrada["firma"] = firma
+    manifest[str(sp["taxon_id"])] = entrada
+    guardar_manifest(manifest)
+
+print(f"Especies procesadas en esta ejecución: {len(por_procesar)} "
+      f"(reutilizadas de {WORK_DIR}: {len(species_final) - len(por_procesar)})")
+
+# =========================
+# Montar la guía con lo guardado
+# =========================
+story = []
+for sp in species_final:
+    clave = str(sp["taxon_id"])
+    entrada = manifest.get(clave)
+    if not entrada or entrada["vacia"]:
+        continue
+    carpeta = os.path.join(WORK_DIR, clave)
+    nombre_comun = entrada["nombre_comun"]
+    nombre_cientifico = entrada["nombre_cientifico"]
 
     # =========================
     # Agregar al PDF
@@ -236,26 +342,23 @@ for sp in species_final:
     story.append(Paragraph(nombre_comun, styles["NombreComun"]))
     story.append(Paragraph(f"<i>{nombre_cientifico}</i>", styles["NombreCientifico"]))
 
-    if photo_img:
-        img_width, img_height = photo_img.size
-        max_width = 18*cm
-        max_height = 11.57*cm
+    if entrada["foto"]:
+        img_width, img_height = entrada["foto"]
+        max_width = CAJA_FOTO[0]*mm
+        max_height = CAJA_FOTO[1]*mm
         scale = min(max_width/img_width, max_height/img_height)
         display_width = img_width*scale
         display_height = img_height*scale
 
-        buf_img = BytesIO()
-        photo_img.save(buf_img, format="JPEG")
-        buf_img.seek(0)
-        story.append(Image(buf_img, width=display_width, height=display_height))
+        story.append(Image(os.path.join(carpeta, "foto.jpg"), width=display_width, height=display_height))
         story.append(Spacer(1,80))
 
-    story.append(Image(buf_temp, width=19*cm, height=5.94*cm))
+    story.append(Image(os.path.join(carpeta, "fenologia.png"), width=19*cm, height=5.94*cm))
     story.append(PageBreak())
 
     story.append(Paragraph(nombre_comun, styles["NombreComun"]))
     story.append(Paragraph(f"<i>{nombre_cientifico}</i>", styles["NombreCientifico"]))
-    story.append(Image(buf_map, width=16*cm, height=20*cm))
+    story.append(Image(os.path.join(carpeta, "mapa.png"), width=16*cm, height=20*cm))
     story.append(PageBreak())
 
 # =========================
@@ -266,6 +369,8 @@ doc.build(story)
 # =========================
 # Fusionar portada + contenido + contraportada
 # =========================
+from PyPDF2 import PdfMerger
+
 merger = PdfMerger()
 
 if os.path.exists(PORTADA_PDF):
@@ -1,25 +1,26 @@
-import requests
 import pandas as pd
-import geopandas as gpd  # type: ignore
-import matplotlib.pyplot as plt
-from shapely.geometry import Point
 import numpy as np
 import os
 
+from iNaturalist_fotos import foto
+from iNaturalist_observaciones import concatenar, paginas_columnas
+from iNaturalist_parametros import parametro
+from iNaturalist_taxones import nombres, resolver_taxones
+
 # =========================
 # PARÁMETROS EDITABLES
 # =========================
-TAXON_ID = 144830
-PLACE_ID = 10543
-SHAPEFILE = "C:/Users/jaime/Desktop/Guía de plantas y animales no avistados/Shapefile Comunidad de Madrid/municipios_madrid.shp"
-OUTPUT_DIR = "C:/Users/jaime/Desktop/Guía de plantas y animales no avistados"
+TAXON_ID = parametro("taxon_id", 144830)
+PLACE_ID = parametro("place_id", 10543)
+SHAPEFILE = parametro("shapefile", "C:/Users/jaime/Desktop/Guía de plantas y animales no avistados/Shapefile Comunidad de Madrid/municipios_madrid.shp")
+OUTPUT_DIR = parametro("carpeta_salida", "C:/Users/jaime/Desktop/Guía de plantas y animales no avistados")
 
 # =========================
 # OBTENER NOMBRE DE LA ESPECIE
 # =========================
-taxon_url = f"https://api.inaturalist.org/v1/taxa/{TAXON_ID}"
-taxon_data = requests.get(taxon_url).json()
-species_name = taxon_data["results"][0]["name"].replace(" ", "_")
+# Una sola petición con locale=es trae el nombre científico y el común
+taxon_data = resolver_taxones([TAXON_ID], locale="es")[TAXON_ID]
+species_name = taxon_data["name"].replace(" ", "_")
 
 OUTPUT_MAP = os.path.join(OUTPUT_DIR, f"{species_name}_map.png")
 
@@ -28,7 +29,7 @@ OUTPUT_MAP = os.path.join(OUTPUT_DIR, f"{species_name}_map.png")
 # =========================
 print("Descargando foto del taxón...")
 
-photo_info = taxon_data["results"][0].get("default_photo")
+photo_info = taxon_data.get("default_photo")
 
 photo_url = None
 
@@ -39,9 +40,11 @@ if photo_info:
         # Convertir square → large
         photo_url = photo_info["url"].replace("square", "large")
 
-if photo_url:
+photo_path = None
+img_data = foto(photo_url, timeout=30) if photo_url else None
+
+if img_data:
     photo_path = os.path.join(OUTPUT_DIR, f"{species_name}_photo.jpg")
-    img_data = requests.get(photo_url).content
 
     with open(photo_path, "wb") as f:
         f.write(img_data)
@@ -55,36 +58,14 @@ else:
 # =========================
 print("Descargando observaciones de iNaturalist...")
 
-url = "https://api.inaturalist.org/v1/observations"
 params = {
     "taxon_id": TAXON_ID,
     "place_id": PLACE_ID,
-    "quality_grade": "research",
-    "per_page": 200,
-    "page": 1
+    "quality_grade": "research"
 }
 
-records = []
-
-while True:
-    r = requests.get(url, params=params).json()
-    results = r["results"]
-
-    if not results:
-        break
-
-    for obs in results:
-        if obs["geojson"]:
-            lon, lat = obs["geojson"]["coordinates"]
-            records.append({
-                "lon": lon,
-                "lat": lat,
-                "observed_on": obs["observed_on"]
-            })
-
-    params["page"] += 1
-
-df_obs = pd.DataFrame(records)
+# Sólo id, coordenadas y fecha (fields + geo=true), decodificado en columnas
+df_obs = pd.DataFrame(concatenar(paginas_columnas(params))).dropna(subset=["lon", "lat"])
 
 if df_obs.empty:
     raise ValueError("No se han encontrado observaciones para este taxon_id")
@@ -94,6 +75,10 @@ print(f"Observaciones descargadas: {len(df_obs)}")
 # =========================
 # GEODATAFRAME DE OBSERVACIONES
 # =========================
+import geopandas as gpd  # type: ignore
+import matplotlib.pyplot as plt
+from shapely.geometry import Point
+
 gdf_obs = gpd.GeoDataFrame(
     df_obs,
     geometry=[Point(xy) for xy in zip(df_obs.lon, df_obs.lat)],
@@ -270,15 +255,8 @@ pdfmetrics.registerFont(TTFont("TimesNewRomanItalic", "C:/Users/jaime/Desktop/Gu
 # --------
 # Nombre común en español
 # --------
-taxon_es_url = f"https://api.inaturalist.org/v1/taxa/{TAXON_ID}?locale=es"
-taxon_es_data = requests.get(taxon_es_url).json()
-
-nombre_comun = taxon_es_data["results"][0].get(
-    "preferred_common_name",
-    species_name.replace("_", " ")
-).lower().capitalize()
-
-nombre_cientifico = taxon_data["results"][0]["name"]
+nombre_cientifico, nombre_comun = nombres(taxon_data)
+nombre_comun = nombre_comun.lower().capitalize()
 
 # --------
 # Documento
@@ -320,9 +298,9 @@ story = []
 story.append(Paragraph(nombre_comun, styles["NombreComun"]))
 story.append(Paragraph(f"<i>{nombre_cientifico}</i>", styles["NombreCientifico"]))
 
-# Foto del taxón (desde URL)
-if photo_url:
-    story.append(Image(photo_url, width=18*cm, height=11.57*cm))
+# Foto del taxón (ya descargada por la Session compartida)
+if photo_path:
+    story.append(Image(photo_path, width=18*cm, height=11.57*cm))
     story.append(Spacer(1, 80))
 
 # Gráfico fenológico
@@ -0,0 +1,114 @@
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# =========================
+# Limitador de peticiones compartido (token bucket + AIMD)
+# =========================
+# Sustituye a los time.sleep fijos de los scripts. Todas las peticiones a la API
+# piden un token antes de salir:
+#   - el cubo se rellena a "tasa" tokens/segundo (hasta "capacidad" de ráfaga);
+#   - cada respuesta correcta sube la tasa y la concurrencia un poco (aumento aditivo);
+#   - cada 429 las reduce a la mitad (disminución multiplicativa) y bloquea el
+#     cubo durante lo que indique Retry-After o las cabeceras de rate limit.
+# iNaturalist pide no pasar de ~60 peticiones/minuto de media, así que se arranca
+# en 1/s y se deja subir como mucho a 100/minuto.
+
+TASA_INICIAL = 1.0
+TASA_MIN = 0.2
+TASA_MAX = 100 / 60
+CAPACIDAD = 5
+CONCURRENCIA_INICIAL = 2
+CONCURRENCIA_MAX = 8
+AUMENTO_TASA = 0.02
+ESPERA_429 = 10
+
+
+def _segundos_retry_after(valor):
+    # Retry-After puede venir en segundos o como fecha HTTP
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Limitador:
+    def __init__(self, tasa=TASA_INICIAL, capacidad=CAPACIDAD, concurrencia=CONCURRENCIA_INICIAL):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.tokens = float(capacidad)
+        self.concurrencia = float(concurrencia)
+        self.en_curso = 0
+        self.bloqueado_hasta = 0.0
+        self._ultimo = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _rellenar(self):
+        ahora = time.monotonic()
+        self.tokens = min(self.capacidad, self.tokens + (ahora - self._ultimo) * self.tasa)
+        self._ultimo = ahora
+
+    def adquirir(self):
+        with self._cond:
+            while True:
+                ahora = time.monotonic()
+                if ahora < self.bloqueado_hasta:
+                    self._cond.wait(self.bloqueado_hasta - ahora)
+                    continue
+                if self.en_curso >= int(self.concurrencia):
+                    self._cond.wait()
+                    continue
+                self._rellenar()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.en_curso += 1
+                    return
+                self._cond.wait((1 - self.tokens) / self.tasa)
+
+    def registrar(self, status_code=None, headers=None):
+        headers = headers or {}
+        with self._cond:
+            self.en_curso = max(0, self.en_curso - 1)
+            if status_code == 429:
+                self.tasa = max(TASA_MIN, self.tasa / 2)
+                self.concurrencia = max(1.0, self.concurrencia / 2)
+                self.tokens = 0.0
+                espera = _segundos_retry_after(headers.get("Retry-After"))
+                self._bloquear(espera if espera is not None else ESPERA_429)
+            elif status_code is not None and status_code < 500:
+                self.tasa = min(TASA_MAX, self.tasa + AUMENTO_TASA)
+                self.concurrencia = min(CONCURRENCIA_MAX, self.concurrencia + 1 / self.concurrencia)
+                self._cabeceras_rate_limit(headers)
+            self._cond.notify_all()
+
+    def _cabeceras_rate_limit(self, headers):
+        # X-RateLimit-* o RateLimit-* (borrador IETF): si no queda cupo, esperar al reset
+        restantes = headers.get("X-RateLimit-Remaining", headers.get("RateLimit-Remaining"))
+        reset = headers.get("X-RateLimit-Reset", headers.get("RateLimit-Reset"))
+        try:
+            restantes = int(restantes)
+        except (TypeError, ValueError):
+            return
+        if restantes > 0:
+            return
+        try:
+            reset = float(reset)
+        except (TypeError, ValueError):
+            reset = ESPERA_429
+        # Algunos servidores mandan un timestamp epoch en lugar de segundos restantes
+        if reset > 1e9:
+            reset = max(0.0, reset - time.time())
+        self._bloquear(reset)
+
+    def _bloquear(self, segundos):
+        self.bloqueado_hasta = max(self.bloqueado_hasta, time.monotonic() + segundos)
+
+
+# Instancia única para todo el proceso
+limitador = Limitador()
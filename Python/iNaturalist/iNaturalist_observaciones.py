@@ -0,0 +1,114 @@
+import numpy as np
+
+import iNaturalist_api as api
+
+# =========================
+# Observaciones proyectadas y en columnas
+# =========================
+# La v1 de /observations siempre devuelve la observación completa (usuario,
+# identificaciones, fotos, anotaciones...). La v2 acepta el parámetro "fields"
+# (sintaxis RISON) y devuelve sólo lo que se pide; con geo=true además se
+# descartan en el servidor las observaciones sin coordenadas.
+#
+# Cada columna se define como nombre -> ruta dentro del JSON; de las rutas se
+# saca la proyección "fields" y cada página se vuelca directamente en arrays de
+# numpy (int64/float64 para ids y coordenadas, object para textos) en lugar de
+# acumular un dict por observación.
+
+COLUMNAS_GEO = {
+    "id": ("id",),
+    "lon": ("geojson", "coordinates", 0),
+    "lat": ("geojson", "coordinates", 1),
+    "observed_on": ("observed_on",),
+}
+
+TIPOS = {
+    "id": np.int64,
+    "lon": np.float64,
+    "lat": np.float64,
+    "latitude": np.float64,
+    "longitude": np.float64,
+}
+
+
+def api_v2_url():
+    return api.API_URL.rsplit("/v1", 1)[0] + "/v2"
+
+
+def campos_rison(columnas):
+    # {"lon": ("geojson", "coordinates", 0), ...} -> "(geojson:(coordinates:!t),...)"
+    arbol = {}
+    for ruta in columnas.values():
+        claves = [c for c in ruta if isinstance(c, str)]
+        nodo = arbol
+        for clave in claves[:-1]:
+            nodo = nodo.setdefault(clave, {})
+            if nodo is True:
+                break
+        else:
+            nodo.setdefault(claves[-1], True)
+
+    def rison(nodo):
+        return "(" + ",".join(
+            f"{k}:!t" if v is True else f"{k}:{rison(v)}" for k, v in sorted(nodo.items())
+        ) + ")"
+
+    return rison(arbol)
+
+
+def _valor(obs, ruta):
+    for clave in ruta:
+        if obs is None:
+            return None
+        try:
+            obs = obs[clave]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return obs
+
+
+def decodificar_pagina(results, columnas):
+    pagina = {}
+    for nombre, ruta in columnas.items():
+        valores = [_valor(obs, ruta) for obs in results]
+        tipo = TIPOS.get(nombre, object)
+        if tipo is np.float64:
+            pagina[nombre] = np.array([np.nan if v is None else v for v in valores], dtype=tipo)
+        elif tipo is object:
+            # Asignación elemento a elemento: las listas (p. ej. ancestor_ids) quedan como un objeto por fila
+            columna = np.empty(len(valores), dtype=object)
+            for i, v in enumerate(valores):
+                columna[i] = v
+            pagina[nombre] = columna
+        else:
+            pagina[nombre] = np.array(valores, dtype=tipo)
+    return pagina
+
+
+def paginas_columnas(params, columnas=COLUMNAS_GEO, geo=True, per_page=200, checkpoint=None):
+    # Generador de páginas en columnas (dict nombre -> array) por cursor id_above
+    params = dict(params)
+    params["fields"] = campos_rison(columnas)
+    if geo:
+        params["geo"] = "true"
+    for results in api.paginas_por_id(f"{api_v2_url()}/observations", params, per_page, checkpoint):
+        yield decodificar_pagina(results, columnas)
+
+
+def concatenar(paginas, columnas=COLUMNAS_GEO, max_obs=None):
+    # Une las páginas en un único dict de arrays (listo para pd.DataFrame)
+    trozos = {nombre: [] for nombre in columnas}
+    total = 0
+    for pagina in paginas:
+        for nombre in columnas:
+            trozos[nombre].append(pagina[nombre])
+        total += len(pagina["id"]) if "id" in pagina else 0
+        if max_obs is not None and total >= max_obs:
+            break
+    resultado = {}
+    for nombre in columnas:
+        if trozos[nombre]:
+            resultado[nombre] = np.concatenate(trozos[nombre])[:max_obs]
+        else:
+            resultado[nombre] = np.array([], dtype=TIPOS.get(nombre, object))
+    return resultado
@@ -0,0 +1,14 @@
+# =========================
+# Parámetros de los scripts
+# =========================
+# Cada script sigue teniendo sus valores por defecto en la cabecera, pero los
+# lee con parametro(nombre, por_defecto). Ejecutado directamente (python
+# script.py) usa esos valores; lanzado desde iNaturalist_cli.py se usan los que
+# se hayan dado en la línea de comandos.
+
+PARAMETROS = {}
+
+
+def parametro(nombre, por_defecto):
+    valor = PARAMETROS.get(nombre)
+    return por_defecto if valor is None else valor
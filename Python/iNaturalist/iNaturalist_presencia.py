@@ -0,0 +1,153 @@
+import math
+
+from iNaturalist_api import get_json_concurrente
+
+# =========================
+# Motor de presencia por lugar
+# =========================
+# Una petición species_counts por lugar con todos los taxon_ids separados por
+# comas; los lugares se consultan a la vez (bajo el limitador compartido) y los
+# que fallan se reintentan en rondas posteriores en lugar de saltarse. Los
+# recuentos de cada taxón se suman subiendo por ancestor_ids, así que las
+# subespecies cuentan para su especie. El resultado es una matriz taxón × lugar
+# (pandas se importa al construirla, no al cargar el módulo).
+
+PER_PAGE = 500
+
+
+def _contar(results, taxon_ids):
+    conteo = dict.fromkeys(taxon_ids, 0)
+    buscados = set(taxon_ids)
+    for result in results:
+        taxon = result.get("taxon", {})
+        linaje = set(taxon.get("ancestor_ids") or [])
+        linaje.add(taxon.get("id"))
+        for tid in linaje & buscados:
+            conteo[tid] += result.get("count", 0)
+    return conteo
+
+
+def matriz_presencia(taxon_ids, places, months=None, rondas=3, concurrencia=8):
+    # places: lista de {"id": ..., "name": ...} (p. ej. la hoja de países)
+    base = {
+        "taxon_id": ",".join(str(t) for t in taxon_ids),
+        "verifiable": "true"
+    }
+    if months:
+        base["month"] = ",".join(str(m) for m in months)
+
+    filas = {}
+    pendientes = list(places)
+    for ronda in range(1, rondas + 1):
+        if not pendientes:
+            break
+        if ronda > 1:
+            print(f"Reintentando {len(pendientes)} lugares (ronda {ronda}/{rondas})…")
+        peticiones = [
+            ("observations/species_counts", {**base, "place_id": place["id"], "per_page": PER_PAGE, "page": 1})
+            for place in pendientes
+        ]
+        fallidos = []
+        for place, data in zip(pendientes, get_json_concurrente(peticiones, concurrencia)):
+            if data is None:
+                fallidos.append(place)
+                continue
+            results = data.get("results", [])
+            paginas = math.ceil((data.get("total_results") or 0) / PER_PAGE)
+            if paginas > 1:
+                # Taxón muy diverso en ese lugar: se completan el resto de páginas. Si
+                # falta cualquiera, el lugar entero vuelve a la ronda siguiente
+                resto = get_json_concurrente([
+                    ("observations/species_counts", {**base, "place_id": place["id"], "per_page": PER_PAGE, "page": page})
+                    for page in range(2, paginas + 1)
+                ], concurrencia)
+                if any(d is None for d in resto):
+                    fallidos.append(place)
+                    continue
+                for d in resto:
+                    results = results + d.get("results", [])
+            filas[place["name"]] = _contar(results, taxon_ids)
+        pendientes = fallidos
+
+    if pendientes:
+        print(f"⚠️ Sin datos para {len(pendientes)} lugares: {', '.join(p['name'] for p in pendientes)}")
+
+    import pandas as pd
+
+    columnas = [place["name"] for place in places if place["name"] in filas]
+    matriz = pd.DataFrame(filas, index=list(taxon_ids), columns=columnas)
+    return matriz.fillna(0).astype(int)
+
+
+# =========================
+# Especies de varios lugares a la vez
+# =========================
+# Para comparar lugares anidados (método extensivo de endemismos): todas las
+# especies de cada lugar, sin lista previa de taxones. Primero se pide a la vez
+# la página 1 de todos los lugares y, con sus total_results, el resto de páginas
+# de todos los lugares en un único lote concurrente. Como en matriz_presencia,
+# un lugar al que le falte cualquier página se reintenta entero en la ronda
+# siguiente y, si sigue fallando, se deja fuera de la matriz (nunca cuenta como
+# 0). El resultado es una matriz de recuentos taxón × lugar (0 donde no aparece)
+# y los datos de cada taxón.
+
+
+def especies_por_lugar(taxon_ids, place_ids, params=None, concurrencia=8, rondas=3):
+    base = {**(params or {}), "taxon_id": ",".join(str(t) for t in taxon_ids), "per_page": PER_PAGE}
+
+    resultados = {}
+    pendientes = list(place_ids)
+    for ronda in range(1, rondas + 1):
+        if not pendientes:
+            break
+        if ronda > 1:
+            print(f"Reintentando {len(pendientes)} lugares (ronda {ronda}/{rondas})…")
+        primeras = get_json_concurrente(
+            [("observations/species_counts", {**base, "place_id": pid, "page": 1}) for pid in pendientes], concurrencia
+        )
+
+        fallidos = []
+        parciales = {}
+        resto = []
+        for pid, data in zip(pendientes, primeras):
+            if data is None:
+                fallidos.append(pid)
+                continue
+            parciales[pid] = list(data.get("results", []))
+            paginas = math.ceil((data.get("total_results") or 0) / PER_PAGE)
+            resto.extend((pid, page) for page in range(2, paginas + 1))
+
+        if resto:
+            peticiones = [("observations/species_counts", {**base, "place_id": pid, "page": page}) for pid, page in resto]
+            for (pid, page), data in zip(resto, get_json_concurrente(peticiones, concurrencia)):
+                if pid not in parciales:
+                    continue
+                if data is None:
+                    del parciales[pid]
+                    fallidos.append(pid)
+                    continue
+                parciales[pid].extend(data.get("results", []))
+
+        resultados.update(parciales)
+        pendientes = fallidos
+
+    if pendientes:
+        print(f"⚠️ Sin datos completos para {len(pendientes)} lugares, se dejan fuera: {', '.join(str(p) for p in pendientes)}")
+
+    conteos = {}
+    taxones = {}
+    for pid, results in resultados.items():
+        columna = {}
+        for result in results:
+            taxon = result.get("taxon", {})
+            tid = taxon.get("id")
+            if tid is None:
+                continue
+            columna[tid] = result.get("count", 0)
+            taxones.setdefault(tid, taxon)
+        conteos[pid] = columna
+
+    import pandas as pd
+
+    matriz = pd.DataFrame(conteos, columns=[pid for pid in place_ids if pid in conteos])
+    return matriz.fillna(0).astype(int), taxones
@@ -0,0 +1,188 @@
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+# =========================
+# Grabación y reproducción de la API (fixtures locales)
+# =========================
+# Grabar: con INAT_RECORD_DIR=<carpeta> cualquier script guarda cada respuesta
+# que recibe (API y fotos, incluidos los 429 y todas las páginas) en esa carpeta:
+# un manifest.jsonl con clave, status y cabeceras, y el cuerpo en un .bin aparte.
+#
+# Reproducir: python iNaturalist_replay.py <carpeta> --puerto 8765 [--latencia 0.1] [--rpm 60]
+# levanta un servidor local que devuelve lo grabado, en el mismo orden para las
+# peticiones repetidas, con la latencia y el límite de peticiones que se pidan.
+# Los scripts se apuntan a él con INAT_REPLAY_URL=http://127.0.0.1:8765 (o
+# sólo la API con INAT_API_URL=http://127.0.0.1:8765/v1).
+
+CABECERAS_GRABADAS = (
+    "Content-Type", "Retry-After",
+    "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset",
+    "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset",
+)
+
+
+def clave_peticion(url, api_url):
+    # Clave sin host: las rutas de la API se comparan por ruta + query ordenada;
+    # cualquier otra URL (fotos) queda como /_externo?url=<url original>
+    partes = urlsplit(url)
+    base = urlsplit(api_url)
+    if (partes.scheme, partes.netloc) == (base.scheme, base.netloc):
+        return partes.path + "?" + urlencode(sorted(parse_qsl(partes.query, keep_blank_values=True)))
+    return "/_externo?" + urlencode({"url": url})
+
+
+# =========================
+# Grabación
+# =========================
+class Grabadora:
+    def __init__(self, directorio, api_url):
+        self.directorio = directorio
+        self.api_url = api_url
+        self._lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+        self._manifest = os.path.join(directorio, "manifest.jsonl")
+        self._n = 0
+        if os.path.exists(self._manifest):
+            with open(self._manifest, encoding="utf-8") as f:
+                self._n = sum(1 for _ in f)
+
+    def __call__(self, response, *args, **kwargs):
+        # Hook "response" de requests: se llama con cada respuesta de la Session
+        clave = clave_peticion(response.request.url, self.api_url)
+        cabeceras = {k: response.headers[k] for k in CABECERAS_GRABADAS if k in response.headers}
+        with self._lock:
+            self._n += 1
+            fichero = f"{self._n:06d}.bin"
+            with open(os.path.join(self.directorio, fichero), "wb") as f:
+                f.write(response.content)
+            with open(self._manifest, "a", encoding="utf-8") as f:
+                f.write(json.dumps({
+                    "clave": clave,
+                    "status": response.status_code,
+                    "headers": cabeceras,
+                    "fichero": fichero,
+                }, ensure_ascii=False) + "\n")
+        return response
+
+
+def activar_grabacion(session, directorio, api_url):
+    session.hooks["response"].append(Grabadora(directorio, api_url))
+    print(f"🎙️ Grabando respuestas de la API en {directorio}")
+
+
+# =========================
+# Reproducción
+# =========================
+class Fixtures:
+    def __init__(self, directorio, ignorar_429=False):
+        self.directorio = directorio
+        self.respuestas = {}
+        self._siguiente = {}
+        self._lock = threading.Lock()
+        with open(os.path.join(directorio, "manifest.jsonl"), encoding="utf-8") as f:
+            for linea in f:
+                entrada = json.loads(linea)
+                if ignorar_429 and entrada["status"] == 429:
+                    continue
+                self.respuestas.setdefault(entrada["clave"], []).append(entrada)
+
+    def siguiente(self, clave):
+        # Las peticiones repetidas reciben las grabaciones en orden; la última se repite
+        with self._lock:
+            lista = self.respuestas.get(clave)
+            if not lista:
+                return None
+            i = self._siguiente.get(clave, 0)
+            self._siguiente[clave] = i + 1
+            return lista[min(i, len(lista) - 1)]
+
+    def cuerpo(self, entrada):
+        with open(os.path.join(self.directorio, entrada["fichero"]), "rb") as f:
+            return f.read()
+
+
+class LimiteServidor:
+    # Token bucket del lado del servidor para simular el rate limit de la API
+    def __init__(self, rpm, retry_after):
+        self.tasa = rpm / 60 if rpm else None
+        self.tokens = float(rpm or 0)
+        self.capacidad = float(rpm or 0)
+        self.retry_after = retry_after
+        self._ultimo = time.monotonic()
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        if self.tasa is None:
+            return True
+        with self._lock:
+            ahora = time.monotonic()
+            self.tokens = min(self.capacidad, self.tokens + (ahora - self._ultimo) * self.tasa)
+            self._ultimo = ahora
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+def crear_servidor(fixtures, puerto=8765, latencia=0.0, rpm=None, retry_after=1):
+    limite = LimiteServidor(rpm, retry_after)
+
+    class Manejador(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if latencia:
+                time.sleep(latencia)
+            if not limite.permitir():
+                self._responder(429, {"Retry-After": str(limite.retry_after)}, b'{"error":"Too Many Requests"}')
+                return
+            partes = urlsplit(self.path)
+            query = parse_qsl(partes.query, keep_blank_values=True)
+            if partes.path == "/_externo":
+                clave = "/_externo?" + urlencode({"url": dict(query).get("url", "")})
+            else:
+                clave = partes.path + "?" + urlencode(sorted(query))
+            entrada = fixtures.siguiente(clave)
+            if entrada is None:
+                self._responder(404, {"Content-Type": "application/json"},
+                                json.dumps({"error": "sin grabación", "clave": clave}).encode("utf-8"))
+                return
+            self._responder(entrada["status"], entrada["headers"], fixtures.cuerpo(entrada))
+
+        def _responder(self, status, headers, cuerpo):
+            self.send_response(status)
+            for k, v in headers.items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, formato, *args):
+            pass
+
+    return ThreadingHTTPServer(("127.0.0.1", puerto), Manejador)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local que reproduce respuestas grabadas de iNaturalist")
+    parser.add_argument("directorio", help="carpeta grabada con INAT_RECORD_DIR")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos de espera por petición")
+    parser.add_argument("--rpm", type=int, default=None, help="peticiones por minuto antes de devolver 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="valor de Retry-After en los 429 simulados")
+    parser.add_argument("--ignorar-429", action="store_true", help="no reproducir los 429 grabados")
+    args = parser.parse_args()
+
+    fixtures = Fixtures(args.directorio, ignorar_429=args.ignorar_429)
+    servidor = crear_servidor(fixtures, args.puerto, args.latencia, args.rpm, args.retry_after)
+    print(f"Reproduciendo {sum(len(v) for v in fixtures.respuestas.values())} respuestas "
+          f"en http://127.0.0.1:{args.puerto} (INAT_REPLAY_URL=http://127.0.0.1:{args.puerto})")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,229 @@
+import json
+import os
+import sqlite3
+import tempfile
+
+import iNaturalist_cache as cache
+from iNaturalist_api import RECORD_DIR, REPLAY_URL, get_json, paginar_concurrente
+
+# =========================
+# Resolución de taxones por lotes
+# =========================
+# /v1/taxa/{id1,id2,...}?locale=es devuelve en una sola respuesta el nombre
+# científico ("name") y el nombre común en español ("preferred_common_name")
+# de hasta MAX_IDS_TAXA taxones. Cada taxón se guarda además por separado en la
+# caché ("taxa/{id}" + locale), así que las siguientes ejecuciones lo encuentran
+# sin volver a pedirlo.
+
+MAX_IDS_TAXA = 30
+MAX_IDS_CONSULTA = 100
+
+RANGOS_ESPECIE = {"species", "hybrid"}
+RANGOS_INFRAESPECIFICOS = {"subspecies", "variety", "form", "infrahybrid"}
+NIVEL_ESPECIE = 10
+
+TAXONOMIA_DB = os.environ.get(
+    "INAT_TAXONOMIA_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "taxonomia.sqlite")
+)
+if REPLAY_URL or RECORD_DIR:
+    # Como la caché de respuestas: grabando, los taxones se piden todos a la API para
+    # que lleguen a la grabación, y reproduciendo no se usa lo guardado de otras ejecuciones
+    TAXONOMIA_DB = os.path.join(tempfile.mkdtemp(prefix="inat_taxonomia_"), "taxonomia.sqlite")
+
+_memoria = {}
+
+
+def resolver_taxones(taxon_ids, locale="es"):
+    # Devuelve {taxon_id: taxon} para todos los ids que la API conozca
+    resultado = {}
+    pendientes = []
+    for tid in dict.fromkeys(int(t) for t in taxon_ids if t is not None):
+        if (locale, tid) in _memoria:
+            resultado[tid] = _memoria[(locale, tid)]
+            continue
+        data = cache.leer(f"taxa/{tid}", {"locale": locale})
+        if data and data.get("results"):
+            _memoria[(locale, tid)] = resultado[tid] = data["results"][0]
+        else:
+            pendientes.append(tid)
+
+    for i in range(0, len(pendientes), MAX_IDS_TAXA):
+        lote = pendientes[i:i + MAX_IDS_TAXA]
+        data = get_json("taxa/" + ",".join(str(t) for t in lote), {"locale": locale, "per_page": MAX_IDS_TAXA})
+        if data is None:
+            print(f"⚠️ No se pudieron obtener los taxones {lote[0]}…{lote[-1]}")
+            continue
+        for taxon in data.get("results", []):
+            tid = taxon["id"]
+            _memoria[(locale, tid)] = resultado[tid] = taxon
+            cache.guardar(f"taxa/{tid}", {"locale": locale}, {"total_results": 1, "results": [taxon]})
+
+    return resultado
+
+
+def nombres(taxon, por_defecto=""):
+    # (nombre científico, nombre común) de un taxón resuelto con resolver_taxones
+    if not taxon:
+        return por_defecto, por_defecto
+    cientifico = taxon.get("name", por_defecto)
+    return cientifico, taxon.get("preferred_common_name") or cientifico
+
+
+def padre(ancestros, taxon_id):
+    # ancestor_ids termina en el propio taxón; el anterior es su padre
+    if ancestros and ancestros[-1] == taxon_id:
+        ancestros = ancestros[:-1]
+    return ancestros[-1] if ancestros else taxon_id
+
+
+# =========================
+# Planificador de consultas por taxón
+# =========================
+# La API acepta taxon_id=1,2,3: en lugar de paginar cada grupo configurado por
+# separado se piden todos juntos. Antes se quitan los repetidos y los grupos que
+# ya están dentro de otro de la lista (p. ej. Aves junto a Accipitridae), y los
+# resultados se deduplican por taxón por si dos lotes se solapan.
+
+
+def consultas_taxones(taxon_ids):
+    # Lista de valores para el parámetro taxon_id ([None] = sin filtro de taxón)
+    ids = list(dict.fromkeys(int(t) for t in (taxon_ids or []) if t is not None))
+    if not ids:
+        return [None]
+    if len(ids) > 1:
+        taxones = resolver_taxones(ids)
+        incluidos = set(ids)
+        ids = [
+            t for t in ids
+            if not incluidos & (set((taxones.get(t) or {}).get("ancestor_ids") or []) - {t})
+        ]
+    return [",".join(str(t) for t in ids[i:i + MAX_IDS_CONSULTA]) for i in range(0, len(ids), MAX_IDS_CONSULTA)]
+
+
+def species_counts(params, taxon_ids=None, per_page=100):
+    # Resultados de species_counts para todos los taxon_ids con el mínimo de consultas
+    vistos = set()
+    for consulta in consultas_taxones(taxon_ids):
+        if consulta is not None:
+            params = {**params, "taxon_id": consulta}
+        for result in paginar_concurrente("observations/species_counts", params, per_page=per_page):
+            tid = (result.get("taxon") or {}).get("id")
+            if tid in vistos:
+                continue
+            vistos.add(tid)
+            yield result
+
+
+# =========================
+# Taxonomía local
+# =========================
+# Tabla (taxon_id, rank, rank_level, ancestor_ids, nombres) guardada en SQLite y
+# cargada en memoria. Se rellena sola: registrar() aprovecha los taxones que ya
+# vienen en cualquier respuesta (species_counts, observaciones) y asegurar() pide
+# a /v1/taxa, por lotes, sólo los que falten. Sobre ella, a_especie() trabaja con
+# arrays de numpy de taxon IDs, de modo que las comparaciones entre listas se
+# hacen con enteros (np.isin) y no con nombres.
+# numpy se importa dentro de cada método: quien sólo usa species_counts o
+# resolver_taxones (p. ej. --lista) no lo carga.
+
+
+class Taxonomia:
+    def __init__(self, ruta=TAXONOMIA_DB):
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        self.conn = sqlite3.connect(ruta)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS taxones (
+                taxon_id INTEGER PRIMARY KEY,
+                rank TEXT,
+                rank_level REAL,
+                ancestor_ids TEXT,
+                name TEXT,
+                common_name TEXT
+            )
+        """)
+        self.taxones = {}
+        for tid, rank, nivel, ancestros, nombre, comun in self.conn.execute("SELECT * FROM taxones"):
+            self.taxones[tid] = {
+                "rank": rank,
+                "rank_level": nivel,
+                "ancestor_ids": json.loads(ancestros) if ancestros else [],
+                "name": nombre,
+                "common_name": comun,
+            }
+
+    def registrar(self, taxones):
+        # Añade taxones completos (dicts de la API) sin hacer peticiones
+        filas = []
+        for taxon in taxones:
+            if not taxon or taxon.get("id") is None or taxon.get("rank_level") is None:
+                continue
+            tid = taxon["id"]
+            ancestros = taxon.get("ancestor_ids") or []
+            comun = taxon.get("preferred_common_name")
+            previo = self.taxones.get(tid)
+            if previo and previo["ancestor_ids"] == ancestros and (previo["common_name"] or not comun):
+                continue
+            self.taxones[tid] = {
+                "rank": taxon.get("rank"),
+                "rank_level": taxon["rank_level"],
+                "ancestor_ids": ancestros,
+                "name": taxon.get("name"),
+                "common_name": comun or (previo or {}).get("common_name"),
+            }
+            filas.append((tid, taxon.get("rank"), taxon["rank_level"], json.dumps(ancestros),
+                          taxon.get("name"), self.taxones[tid]["common_name"]))
+        if filas:
+            self.conn.executemany("INSERT OR REPLACE INTO taxones VALUES (?, ?, ?, ?, ?, ?)", filas)
+            self.conn.commit()
+
+    def asegurar(self, taxon_ids):
+        # Pide a la API (por lotes de MAX_IDS_TAXA) los taxones que aún no están
+        import numpy as np
+        faltan = [int(t) for t in np.unique(np.asarray(taxon_ids, dtype=np.int64)) if int(t) not in self.taxones]
+        if faltan:
+            self.registrar(resolver_taxones(faltan).values())
+
+    def _es_infraespecifico(self, tid):
+        taxon = self.taxones.get(tid)
+        return taxon is not None and taxon["rank_level"] is not None and taxon["rank_level"] < NIVEL_ESPECIE
+
+    def _ancestros(self, tid):
+        return [a for a in self.taxones[tid]["ancestor_ids"] if a != tid]
+
+    def _especie_de(self, tid):
+        if not self._es_infraespecifico(tid):
+            return tid
+        # Infraespecífico: el ancestro más cercano con nivel de especie (ya asegurado en a_especie)
+        for a in reversed(self._ancestros(tid)):
+            nivel = self.taxones.get(a, {}).get("rank_level")
+            if nivel is not None and nivel >= NIVEL_ESPECIE:
+                return a if nivel == NIVEL_ESPECIE else tid
+        return tid
+
+    def a_especie(self, taxon_ids):
+        # Array de IDs -> array de IDs subidos a especie (lo que está en especie o por
+        # encima se queda igual). Se calcula una vez por ID distinto.
+        import numpy as np
+        ids = np.asarray(taxon_ids, dtype=np.int64)
+        unicos, inversa = np.unique(ids, return_inverse=True)
+        self.asegurar(unicos)
+        # Los ancestros cercanos de todos los infraespecíficos, pedidos en un solo lote
+        ancestros = []
+        for t in unicos:
+            if self._es_infraespecifico(int(t)):
+                ancestros.extend(self._ancestros(int(t))[-3:])
+        if ancestros:
+            self.asegurar(ancestros)
+        return np.array([self._especie_de(int(t)) for t in unicos], dtype=np.int64)[inversa]
+
+
+_taxonomia = None
+
+
+def taxonomia():
+    # Instancia compartida (se abre al primer uso)
+    global _taxonomia
+    if _taxonomia is None:
+        _taxonomia = Taxonomia()
+    return _taxonomia
@@ -0,0 +1,175 @@
+from datetime import date, timedelta
+
+from iNaturalist_api import get_json_concurrente, paginar_concurrente
+from iNaturalist_taxones import RANGOS_ESPECIE, RANGOS_INFRAESPECIFICOS, padre, species_counts
+
+# =========================
+# Lista de vida del usuario
+# =========================
+# Descarga una sola vez las especies observadas por un usuario (species_counts
+# con user_login) y devuelve un set de taxon IDs. Con incluir_ancestros=True se
+# añaden también los ancestor_ids de cada taxón, de modo que observar una
+# subespecie cuenta como haber visto su especie. Así "¿lo ha visto el usuario?"
+# es una comprobación local en el set en lugar de una petición por especie.
+
+
+def lista_de_vida(username, taxon_ids=None, place_id=None, verifiable=True, incluir_ancestros=True):
+    observadas = set()
+    params = {"user_login": username}
+    if verifiable:
+        params["verifiable"] = "true"
+    if place_id is not None:
+        params["place_id"] = place_id
+
+    # Todos los taxon_ids en las mínimas consultas posibles (taxon_id=1,2,3)
+    for result in species_counts(params, taxon_ids):
+        taxon = result.get("taxon", {})
+        tid = taxon.get("id")
+        if tid is None:
+            continue
+        observadas.add(tid)
+        if incluir_ancestros:
+            observadas.update(taxon.get("ancestor_ids") or [])
+    return observadas
+
+
+def ids_observados(usernames, taxon_ids=None, place_id=None, verifiable=True, incluir_ancestros=True):
+    # Unión de las listas de vida de uno o varios usuarios como array ordenado de enteros
+    import numpy as np
+
+    if isinstance(usernames, str):
+        usernames = [usernames]
+    ids = set()
+    for username in usernames:
+        ids |= lista_de_vida(username, taxon_ids, place_id, verifiable, incluir_ancestros)
+    return np.array(sorted(ids), dtype=np.int64)
+
+
+def no_observadas(filas, observadas, campo="Taxon ID", min_observations=0, campo_obs="Observations"):
+    # Filas (dicts) cuyo taxón no está en la lista de vida y que llegan al mínimo
+    # de observaciones. Se compara como arrays de enteros (np.isin), no fila a fila
+    import numpy as np
+
+    if not filas:
+        return []
+    ids = np.fromiter((fila[campo] for fila in filas), dtype=np.int64, count=len(filas))
+    if not isinstance(observadas, np.ndarray):
+        observadas = np.fromiter(observadas, dtype=np.int64, count=len(observadas))
+    mascara = ~np.isin(ids, observadas)
+    if min_observations:
+        conteos = np.fromiter((fila[campo_obs] for fila in filas), dtype=np.int64, count=len(filas))
+        mascara &= conteos >= min_observations
+    return [filas[i] for i in np.flatnonzero(mascara)]
+
+
+# =========================
+# Especies de un lugar que no ha visto nadie del grupo
+# =========================
+# Motor común de los informes "no observadas": species_counts del lugar o área
+# (params: place_id o lat/lng/radius, más los filtros que se quieran) por cada
+# grupo de taxon_ids y, opcionalmente, sólo en ciertos meses; después se quitan
+# las que haya observado cualquiera de los usuarios (en cualquier mes) y las que
+# no llegan a min_observations.
+
+
+def filas_species_counts(params, taxon_ids, months=None):
+    filas = []
+    if months:
+        params = {**params, "month": ",".join(str(m) for m in months)}
+    for result in species_counts(params, taxon_ids):
+        taxon = result.get("taxon", {})
+        if taxon.get("id") is None:
+            continue
+        filas.append({
+            "Taxon ID": taxon["id"],
+            "Common Name": taxon.get("preferred_common_name", "No common name"),
+            "Scientific Name": taxon.get("name", "Unknown"),
+            "Observations": result.get("count", 0),
+            "Photo URL": (taxon.get("default_photo") or {}).get("medium_url"),
+        })
+    return filas
+
+
+def especies_no_observadas(params, taxon_ids, usernames, min_observations=0, months=None):
+    # Devuelve (todas las filas que llegan al mínimo, las no observadas por ningún usuario)
+    filas = no_observadas(filas_species_counts(params, taxon_ids, months), [], min_observations=min_observations)
+    if not filas:
+        return filas, []
+    return filas, no_observadas(filas, ids_observados(usernames, taxon_ids))
+
+
+# =========================
+# Especies nuevas en un rango de fechas (diferencia en el servidor)
+# =========================
+# Alternativa a recorrer todo el historial: una consulta species_counts del
+# usuario hasta el día anterior a fecha_inicio (d2) y otra para [fecha_inicio,
+# fecha_fin]; lo nuevo es la diferencia. Las reglas de rango son las mismas que
+# en iNaturalist_almacen.primeras_vistas: las subespecies suben a su especie y un
+# taxón superior no cuenta si antes ya se había visto una especie por debajo.
+
+
+def _clave(taxon):
+    if taxon.get("rank") in RANGOS_INFRAESPECIFICOS:
+        return padre(taxon.get("ancestor_ids") or [], taxon["id"])
+    return taxon["id"]
+
+
+def nuevas_por_diferencia(username, fecha_inicio, fecha_fin):
+    base = {"user_login": username, "verifiable": "true"}
+    dia_anterior = (date.fromisoformat(fecha_inicio) - timedelta(days=1)).isoformat()
+
+    vistas_antes = set()
+    cubiertos_antes = set()
+    for result in paginar_concurrente("observations/species_counts", {**base, "d2": dia_anterior}):
+        taxon = result["taxon"]
+        vistas_antes.add(_clave(taxon))
+        if taxon.get("rank") in RANGOS_ESPECIE | RANGOS_INFRAESPECIFICOS:
+            cubiertos_antes.update(taxon.get("ancestor_ids") or [])
+
+    filas = {}
+    for result in paginar_concurrente("observations/species_counts", {**base, "d1": fecha_inicio, "d2": fecha_fin}):
+        taxon = result["taxon"]
+        clave = _clave(taxon)
+        es_especie = taxon.get("rank") in RANGOS_ESPECIE | RANGOS_INFRAESPECIFICOS
+        if clave in vistas_antes or clave in filas:
+            continue
+        if not es_especie and clave in cubiertos_antes:
+            continue
+        filas[clave] = {
+            "clave": clave,
+            "taxon_id": taxon["id"],
+            "taxon_name": taxon.get("name"),
+            "common_name": taxon.get("preferred_common_name"),
+            "photo_url": (taxon.get("default_photo") or {}).get("medium_url"),
+            "observed_on": fecha_inicio,
+        }
+
+    # species_counts no da fechas: si la ventana es de más de un día se pide la
+    # primera observación de cada especie nueva (todas a la vez)
+    if filas and fecha_inicio != fecha_fin:
+        peticiones = [
+            ("observations", {**base, "taxon_id": clave, "d1": fecha_inicio, "d2": fecha_fin,
+                              "order_by": "observed_on", "order": "asc", "per_page": 1})
+            for clave in filas
+        ]
+        for clave, data in zip(list(filas), get_json_concurrente(peticiones)):
+            if data and data.get("results"):
+                filas[clave]["observed_on"] = data["results"][0].get("observed_on") or fecha_inicio
+
+    import pandas as pd
+
+    df = pd.DataFrame(list(filas.values()), columns=["clave", "taxon_id", "taxon_name", "common_name", "photo_url", "observed_on"])
+    return df.sort_values(["observed_on", "taxon_name"], kind="stable")
+
+
+def comparar_motores(df_historial, df_servidor):
+    # Claves que sólo da uno de los dos motores (deberían coincidir)
+    a = set(df_historial["clave"])
+    b = set(df_servidor["clave"])
+    solo_historial = df_historial[df_historial["clave"].isin(a - b)]
+    solo_servidor = df_servidor[df_servidor["clave"].isin(b - a)]
+    print(f"Motor historial: {len(a)} taxones nuevos; motor servidor: {len(b)}; en ambos: {len(a & b)}")
+    for nombre, df in (("sólo historial", solo_historial), ("sólo servidor", solo_servidor)):
+        for fila in df.itertuples(index=False):
+            print(f" - {nombre}: {fila.taxon_name} ({fila.clave}) {fila.observed_on}")
+    return solo_historial, solo_servidor